@@ -0,0 +1,65 @@
+# Compare the latency of small compiler batches with a cold Wine (wineserver
+# stopped before each batch) and a warm Wine (persistent wineserver started by
+# the wine_keepalive setting).
+#
+# Usage: python benchmarks/bench_compiler_startup.py [--settings FILE] [--batches N] module_dir script.nss...
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from nwscript_tools import wine  # noqa: E402
+from nwscript_tools.__main__ import load_settings  # noqa: E402
+
+
+def run_batch(args: list, module_dir: str) -> float:
+    start = time.perf_counter()
+    subprocess.call(args, cwd=module_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--settings", action="append", default=[])
+    parser.add_argument("--batches", type=int, default=5)
+    parser.add_argument("module_dir")
+    parser.add_argument("scripts", nargs="+")
+    args = parser.parse_args()
+
+    settings = load_settings(args.settings)
+    compiler_cmd = settings["compiler_cmd"]
+    if wine.find_wine(compiler_cmd) is None:
+        print("compiler_cmd does not use wine, nothing to compare")
+        return
+
+    module_dir = os.path.abspath(args.module_dir)
+    include_args = []
+    for inc in settings["include_path"]:
+        include_args.extend(["-i", inc])
+    batch_args = compiler_cmd + include_args + settings["compiler_args"] + [
+        "-r", module_dir, "-b", module_dir,
+    ] + args.scripts
+
+    cold = []
+    for _ in range(args.batches):
+        wine.stop_wineserver(compiler_cmd)
+        cold.append(run_batch(batch_args, module_dir))
+
+    for proc in wine.start_wineserver(compiler_cmd, 60):
+        proc.wait()
+    warm = []
+    for _ in range(args.batches):
+        warm.append(run_batch(batch_args, module_dir))
+    wine.stop_wineserver(compiler_cmd)
+
+    for name, times in (("cold", cold), ("warm", warm)):
+        print("%s: min %.3f s, avg %.3f s, max %.3f s" % (
+            name, min(times), sum(times) / len(times), max(times)
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# Measure the time and memory needed to load the completions of nwscript.nss,
+# with completion items created on first use (current behavior) and created
+# right away while parsing (previous behavior).
+#
+# Usage: python benchmarks/bench_completion.py [path/to/nwscript.nss]
+# A synthetic nwscript.nss is generated when no file is given. Sublime Text is
+# not needed: the few API functions used while parsing are replaced by
+# minimal stand-ins when the sublime module is not available.
+
+import importlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+from bench_parser import generate_nwscript  # noqa: E402
+
+CACHE_DIR = tempfile.mkdtemp()
+
+
+def install_sublime_stand_ins() -> None:
+    try:
+        import sublime  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    class CompletionItem:
+        def __init__(self, trigger, annotation="", completion="", completion_format=0, kind=None, details=""):
+            self.trigger = trigger
+            self.annotation = annotation
+            self.completion = completion
+            self.completion_format = completion_format
+            self.kind = kind
+            self.details = details
+
+    def load_resource(name):
+        raise FileNotFoundError(name)
+
+    sublime = types.ModuleType("sublime")
+    sublime.CompletionItem = CompletionItem
+    # Only used in type annotations
+    sublime.View = sublime.Window = sublime.Region = object
+    sublime.COMPLETION_FORMAT_TEXT = 0
+    sublime.COMPLETION_FORMAT_SNIPPET = 1
+    sublime.KIND_FUNCTION = (1, "f", "Function")
+    sublime.KIND_TYPE = (2, "t", "Type")
+    sublime.KIND_NAMESPACE = (3, "n", "Namespace")
+    sublime.KIND_ID_VARIABLE = 4
+    sublime.version = lambda: "4126"
+    sublime.cache_path = lambda: CACHE_DIR
+    sublime.load_resource = load_resource
+    sys.modules["sublime"] = sublime
+
+    sublime_plugin = types.ModuleType("sublime_plugin")
+    sublime_plugin.EventListener = object
+    sublime_plugin.WindowCommand = object
+    sys.modules["sublime_plugin"] = sublime_plugin
+
+
+# Import nwscript_completion.py as part of a package, like Sublime Text does
+def import_completion_module():
+    install_sublime_stand_ins()
+    package = types.ModuleType("stnwscript")
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules["stnwscript"] = package
+    return importlib.import_module("stnwscript.nwscript_completion")
+
+
+def create_engine(completion_module):
+    engine = completion_module.NWScriptCompletion()
+    settings = {"doc_fixes": {}, "include_path": []}
+    engine.get_settings_value = settings.get
+    return engine
+
+
+def load(completion_module, nwscript_file: str, eager: bool):
+    engine = create_engine(completion_module)
+    _, compl = engine.parse_script(nwscript_file)
+    if eager:
+        engine.get_completions(compl)
+    return engine, compl
+
+
+def bench(fun, repeat=5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fun()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def measure_memory(fun) -> int:
+    tracemalloc.start()
+    result = fun()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    if len(sys.argv) > 1:
+        nwscript_file = sys.argv[1]
+    else:
+        nwscript_file = os.path.join(CACHE_DIR, "nwscript.nss")
+        with open(nwscript_file, "w", encoding="utf-8") as file:
+            file.write(generate_nwscript())
+
+    completion_module = import_completion_module()
+
+    # Build the symbol index stored in the cache
+    _, compl = load(completion_module, nwscript_file, eager=False)
+    print("%s: %d symbols" % (
+        os.path.basename(nwscript_file) if len(sys.argv) > 1 else "synthetic nwscript.nss",
+        len(compl.completion_decls),
+    ))
+
+    for name, eager in (("items on first use", False), ("items while parsing", True)):
+        duration = bench(lambda: load(completion_module, nwscript_file, eager))
+        memory = measure_memory(lambda: load(completion_module, nwscript_file, eager))
+        print("    %-20s parse %8.2f ms, memory %8.1f KiB" % (name, duration * 1000, memory / 1024))
+
+    # Cost of the first completion query and of documentation popups
+    engine, compl = load(completion_module, nwscript_file, eager=False)
+    duration = bench(lambda: engine.get_completions(compl) and setattr(compl, "completions", None))
+    print("    first completion query: %8.2f ms" % (duration * 1000))
+    doc = compl.documentation[len(compl.documentation) - 1]
+    duration = bench(lambda: doc.make_popup(), repeat=50)
+    print("    documentation popup:    %8.3f ms, then memoized" % (duration * 1000))
+
+
+if __name__ == "__main__":
+    main()
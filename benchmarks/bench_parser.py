@@ -0,0 +1,174 @@
+# Compare the legacy regex declaration scanner with the nwscript_tools.parser
+# tokenizer, on nwscript.nss and on a large include library, and check both
+# return the same declarations.
+#
+# Usage: python benchmarks/bench_parser.py [path/to/nwscript.nss] [path/to/library.nss]
+# Synthetic scripts are generated when no file is given.
+
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from nwscript_tools import parser  # noqa: E402
+
+nwn_types = parser.nwn_types
+legacy_rgx_fun = re.compile(
+    r'((?:^[ \t]*//[^\n]*?\n)*)'
+    r'^[ \t]*' + nwn_types + r'\s+'
+    r'(\w+)\s*'
+    r'\(([^)]*?)\)\s*[;\{]',
+    re.DOTALL | re.MULTILINE)
+legacy_rgx_global_const = re.compile(
+    r'^\s*const\s+'
+    + nwn_types + r'\s+'
+    r'(\w+)'
+    r'\s*=\s*(.+?)\s*;(?:\s*//\s*(.*?)$)?',
+    re.DOTALL | re.MULTILINE)
+legacy_rgx_global_nwscript = re.compile(
+    r'^\s*' + nwn_types + r'\s+'
+    r'(\w+)'
+    r'\s*=\s*(.+?)\s*;(?:\s*//\s*(.*?)$)?',
+    re.DOTALL | re.MULTILINE)
+legacy_rgx_struct = re.compile(r'((?:^[ \t]*//[^\n]*?\n)*)^[ \t]*struct\s+(\w+)\s*\{', re.DOTALL | re.MULTILINE)
+legacy_rgx_define = re.compile(
+    r'((?:^[ \t]*//[^\n]*?\n)*)'
+    r'^\s*#\s*define\s+(\w+)\s+(.+?)\s*$',
+    re.DOTALL | re.MULTILINE)
+
+
+# Declaration scanner used before nwscript_tools.parser.parse_block
+def legacy_parse_block(data: str, is_nwscript: bool) -> (list, bool):
+    decls = []
+    has_main = False
+
+    for (fun_doc, fun_type, fun_name, fun_args) in legacy_rgx_fun.findall(data):
+        if fun_name in ("main", "StartingConditional"):
+            has_main = True
+            continue
+        args = []
+        if fun_args != "" and not fun_args.isspace():
+            for (arg_type, arg_name, arg_value) in parser.rgx_fun_arg.findall(fun_args):
+                if arg_value == "" or arg_value.isspace():
+                    arg_value = None
+                args.append((arg_type, arg_name, arg_value))
+        decls.append(("f", fun_type, fun_name, tuple(args), parser.remove_comments(fun_doc)))
+
+    glob_rgx = legacy_rgx_global_nwscript if is_nwscript else legacy_rgx_global_const
+    for (glob_type, glob_name, glob_value, glob_doc) in glob_rgx.findall(data):
+        decls.append((
+            "c", glob_type, glob_name, glob_value,
+            glob_doc if glob_doc != "" and not glob_doc.isspace() else None
+        ))
+
+    for (def_doc, def_name, def_value) in legacy_rgx_define.findall(data):
+        decls.append((
+            "d", def_name, def_value,
+            "\n".join([line[2:] for line in def_doc.splitlines()])
+            if def_doc != "" and not def_doc.isspace()
+            else None
+        ))
+
+    for (struct_doc, struct_name) in legacy_rgx_struct.findall(data):
+        decls.append(("s", struct_name, parser.remove_comments(struct_doc)))
+
+    return (decls, has_main)
+
+
+# The legacy regexes were run on the whole script
+def legacy_parse(data: str, is_nwscript: bool) -> (list, bool):
+    return legacy_parse_block(data, is_nwscript)
+
+
+# nwscript.nss-like file: constants, then documented engine functions
+def generate_nwscript(function_count: int = 2500, const_count: int = 5000) -> str:
+    lines = ["// Engine functions\n"]
+    for i in range(const_count):
+        lines.append("int CONST_%05d = %d; // Constant %d\n" % (i, i, i))
+    lines.append("\n")
+    for i in range(function_count):
+        lines.append("\n")
+        for j in range(i % 12 + 1):
+            lines.append("// Documentation of Function%05d, line %d. (parenthesis) and {braces}\n" % (i, j))
+        lines.append("// - oTarget: the target\n")
+        lines.append("int Function%05d(object oTarget=OBJECT_SELF, string sTag=\"\", float fDelay=0.0f);\n" % i)
+    return "".join(lines)
+
+
+# Include library: documented functions with bodies and large comment blocks
+def generate_library(function_count: int = 1500) -> str:
+    lines = ['#include "nwscript"\n', "\n"]
+    for i in range(function_count):
+        lines.append("\n")
+        if i % 10 == 0:
+            for j in range(150):
+                lines.append("// Section header comment %d of a large comment block\n" % j)
+            lines.append("\n")
+            lines.append("#define LIB_DEFINE_%05d %d\n" % (i, i))
+            lines.append("const int LIB_CONST_%05d = %d; // library constant\n" % (i, i))
+            lines.append("\n")
+            lines.append("// Library struct %d\n" % i)
+            lines.append("struct lib_struct_%05d { int a; string b; };\n" % i)
+            lines.append("\n")
+        lines.append("// Library function %d\n" % i)
+        lines.append("// Returns something\n")
+        lines.append("string LibFunction%05d(object oTarget, int nValue=%d)\n" % (i, i))
+        lines.append("{\n")
+        lines.append("    string sRet = \"{\" + IntToString(nValue) + \"}\";\n")
+        lines.append("    if (GetIsObjectValid(oTarget)) {\n")
+        lines.append("        sRet += GetName(oTarget); // comment with (parenthesis)\n")
+        lines.append("    }\n")
+        lines.append("    return sRet;\n")
+        lines.append("}\n")
+    return "".join(lines)
+
+
+def bench(fun, repeat=5) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fun()
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+def compare(name: str, data: str, is_nwscript: bool) -> None:
+    legacy = legacy_parse(data, is_nwscript)
+    new = parser.parse(data, is_nwscript)
+    # The legacy scanner did not return includes
+    new = ([decl for decl in new[0] if decl[0] != "i"], new[1])
+    # The legacy define regex also took comments above a blank line as
+    # documentation, so defines are compared without it
+    legacy = ([decl[:3] if decl[0] == "d" else decl for decl in legacy[0]], legacy[1])
+    new = ([decl[:3] if decl[0] == "d" else decl for decl in new[0]], new[1])
+    differences = set(legacy[0]).symmetric_difference(new[0])
+
+    print("%s: %d KiB, %d declarations, %d differences" % (
+        name, len(data) // 1024, len(new[0]), len(differences)
+    ))
+    for decl in sorted(differences, key=str)[:10]:
+        print("    %s %s" % ("legacy only:" if decl in legacy[0] else "new only:   ", decl))
+    print("    legacy regexes:   %8.2f ms" % (bench(lambda: legacy_parse(data, is_nwscript)) * 1000))
+    print("    parser tokenizer: %8.2f ms" % (bench(lambda: parser.parse(data, is_nwscript)) * 1000))
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r", encoding="utf-8", errors="ignore") as file:
+            nwscript = file.read()
+    else:
+        nwscript = generate_nwscript()
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], "r", encoding="utf-8", errors="ignore") as file:
+            library = file.read()
+    else:
+        library = generate_library()
+
+    compare("nwscript.nss" if len(sys.argv) > 1 else "synthetic nwscript.nss", nwscript, True)
+    compare(os.path.basename(sys.argv[2]) if len(sys.argv) > 2 else "synthetic library", library, False)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,35 +2,125 @@ import sublime
 import sublime_plugin
 import os
 import re
+import sys
 import time
 import threading
+import collections
+import concurrent.futures
+import types
 from typing import Any
 from .nwscript_doc_fixes import get_doc_fix
+from .nwscript_tools import dirscan, metadata, parser
+from .nwscript_tools.symbol_index import SymbolIndex, get_data_hash, get_doc_fixes_hash
 
 def plugin_loaded():
     NWScriptCompletion.settings = sublime.load_settings('nwscript.sublime-settings')
 
 class SymbolCompletions:
+    __slots__ = (
+        "file", "resref", "mtime", "dependencies",
+        "completion_decls", "completions",
+        "documentation", "symbol_list",
+        "struct_decls", "structs_completions", "structs_doc",
+    )
+
     def __init__(self):
         self.file = None
+        self.resref = None
         self.mtime = None
         self.dependencies = []
-        self.completions = []
+
+        # Declarations to complete. Completion items are created on first use
+        # by NWScriptCompletion.get_completions, and stored in completions.
+        self.completion_decls = []
+        self.completions = None
 
         self.documentation = []
         self.symbol_list = {}
 
-        self.structs_completions = []
+        # Same for ST3 struct completions
+        self.struct_decls = []
+        self.structs_completions = None
         self.structs_doc = {}
 
-class Documentation:
-    def __init__(self):
-        self.signature = None  # tuple containing type, name and args
-        self.script_resref = None
-        self.fix = None  # (severity, text)
-        self.text = None
+# Completion item and documentation of a declaration in a script being
+# edited, reused when the script is parsed again
+class CompletionEntry:
+    __slots__ = ("completion", "doc")
+
+    def __init__(self, doc: "Documentation"):
+        # Created on first use
+        self.completion = None
+        self.doc = doc
+
+# Background worker parsing scripts being edited.
+# Parse requests are delayed by a few milliseconds and coalesced per file, so
+# only the latest version of a buffer is parsed after a burst of keystrokes.
+# The thread exits when there is nothing left to parse.
+class ParseQueue:
+    def __init__(self, parse_func):
+        self.parse_func = parse_func
+
+        # file path => (monotonic time when parsing can start, module path, file data)
+        self.pending = {}
+
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def push(self, module_path: str, file_path: str, file_data: str, delay: float) -> None:
+        with self.condition:
+            self.pending[file_path] = (time.monotonic() + delay, module_path, file_data)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while True:
+                    if len(self.pending) == 0:
+                        self.thread = None
+                        return
+
+                    file_path = min(self.pending, key=lambda k: self.pending[k][0])
+                    start_time, module_path, file_data = self.pending[file_path]
+                    delay = start_time - time.monotonic()
+                    if delay <= 0:
+                        del self.pending[file_path]
+                        break
+                    self.condition.wait(delay)
+
+            try:
+                self.parse_func(module_path, file_path, file_data)
+            except Exception as e:
+                print("nwscript-completion: could not parse %s: %s" % (file_path, e))
 
-    def format_popup(self):
+class Documentation:
+    __slots__ = ("decl", "script_resref", "fix", "text", "popup")
+
+    #   decl: declaration returned by nwscript_tools.parser
+    def __init__(self, decl: tuple, script_resref: str, fix: tuple = None, text: str = None):
+        self.decl = decl
+        self.script_resref = script_resref
+        self.fix = fix  # (severity, text)
+        self.text = text
+        # HTML returned by format_popup, created on first use
+        self.popup = None
+
+    # Tuple containing kind, type, name and args (the declaration without its
+    # documentation text)
+    @property
+    def signature(self) -> tuple:
+        return self.decl[:-1]
+
+    def format_popup(self) -> str:
+        if self.popup is None:
+            self.popup = self.make_popup()
+        return self.popup
+
+    def make_popup(self) -> str:
+        signature = self.signature
 
         fix_html = ""
         fix_color = None
@@ -56,15 +146,15 @@ class Documentation:
 
         symbol_type_name = None
         signature_html = None
-        if self.signature[0] == "f":
+        if signature[0] == "f":
             # function
 
-            if len(self.signature[3]) > 0:
+            if len(signature[3]) > 0:
                 args_charlen = sum([
                     len(s[0]) + 1 + len(s[1])
                     + (1 + len(s[2]) if s[2] is not None else 0)
-                    for s in self.signature[3]
-                ]) + 2 * (len(self.signature[3]) - 1)
+                    for s in signature[3]
+                ]) + 2 * (len(signature[3]) - 1)
             else:
                 args_charlen = 0
 
@@ -74,42 +164,42 @@ class Documentation:
                     '<span style="color: var(--redish)">=</span><span style="color: var(--purplish)">%s</span>' % s[2]
                     if s[2] is not None else ""
                 )
-                for s in self.signature[3]
+                for s in signature[3]
             ]
 
-            if len(self.signature[1]) + 1 + len(self.signature[2]) + 1 + args_charlen + 1 > 80:
+            if len(signature[1]) + 1 + len(signature[2]) + 1 + args_charlen + 1 > 80:
                 args_html = "<br>\t" + ",<br>\t".join(styled_args) + "<br>"
             else:
                 args_html = ", ".join(styled_args)
 
             symbol_type_name = "function"
             signature_html = '<span style="color: var(--bluish)">%s</span> <span style="color: var(--accent)">%s</span>(%s)' % (
-                self.signature[1], self.signature[2], args_html
+                signature[1], signature[2], args_html
             )
 
-        elif self.signature[0] == "c":
+        elif signature[0] == "c":
             # constant
             symbol_type_name = "constant"
             signature_html = "const %s <strong>%s</strong> = %s" % (
-                self.signature[1], self.signature[2], self.signature[3]
+                signature[1], signature[2], signature[3]
             )
-        elif self.signature[0] == "d":
+        elif signature[0] == "d":
             # define
             symbol_type_name = "define"
             signature_html = "#define <strong>%s</strong> %s" % (
-                self.signature[1], self.signature[2]
+                signature[1], signature[2]
             )
-        elif self.signature[0] == "s":
+        elif signature[0] == "s":
             # struct
             symbol_type_name = "structure"
             signature_html = "struct <strong>%s</strong> {...}" % (
-                self.signature[1]
+                signature[1]
             )
 
         if self.text is not None:
             text = self._indent_fix(self.text)
-            if len(self.signature) >= 4:
-                for _, name, _ in self.signature[3]:
+            if signature[0] == "f":
+                for _, name, _ in signature[3]:
                     text = re.sub(
                         r"\b" + re.escape(name) + r"\b",
                         '<i><span style="color: var(--orangish)">%s</span></i>' % name,
@@ -168,18 +258,85 @@ class Documentation:
         re.MULTILINE)
 
 
+# Approximate memory size in bytes of an object and the objects it references
+#   seen: ids of the objects already counted, shared between calls so shared
+#       objects are counted once
+def get_approx_size(obj, seen: set) -> int:
+    size = 0
+    to_explore = [obj]
+    while len(to_explore) > 0:
+        curr = to_explore.pop()
+        if id(curr) in seen or isinstance(curr, (type, types.ModuleType, types.FunctionType, types.MethodType)):
+            continue
+        seen.add(id(curr))
+        size += sys.getsizeof(curr)
+
+        if isinstance(curr, dict):
+            to_explore.extend(curr.keys())
+            to_explore.extend(curr.values())
+        elif isinstance(curr, (list, tuple, set, frozenset)):
+            to_explore.extend(curr)
+        else:
+            if hasattr(curr, "__dict__"):
+                to_explore.append(curr.__dict__)
+            for name in getattr(type(curr), "__slots__", ()):
+                if hasattr(curr, name):
+                    to_explore.append(getattr(curr, name))
+    return size
+
+
 class NWScriptCompletion(sublime_plugin.EventListener):
     settings = None
+    # Listener created by Sublime Text, for nwscript_completion_stats
+    instance = None
 
     def __init__(self):
         super().__init__()
+        NWScriptCompletion.instance = self
         self.st4 = sublime.version() >= "4073"
 
-        # script resref => SymbolCompletions
-        self.symbol_completions = {}
-
-        # directory => set() of include-only files
-        self.include_completions = None
+        # script resref => SymbolCompletions, least recently used first.
+        # See evict_symbol_completions
+        self.symbol_completions = collections.OrderedDict()
+
+        # Scripts being edited
+        # file path => nwscript_tools.parser.IncrementalParser
+        self.incremental_parsers = {}
+        # file path => dict of declaration => (completion, Documentation)
+        self.completion_entries = {}
+
+        # Scripts being edited are parsed in the background, and completions
+        # are served from the last finished parse
+        self.parse_queue = ParseQueue(self.parse_buffer)
+        self.parse_lock = threading.Lock()
+        # file path => list of include errors found during the last parse
+        self.include_errors = {}
+
+        # (module path, lower case resref) => (search directories, directory
+        # mtimes, file path or None). See find_file_by_resref
+        self.resolved_files = {}
+
+        # (kind, resref) => (include closure, list of completions)
+        # See get_flattened_completions
+        self.flattened_completions = {}
+
+        # symbol => dict of script resref => Documentation, for all parsed scripts
+        self.symbol_definitions = {}
+        # Incremented each time the includes of a script change
+        self.dependencies_generation = 0
+        # resref => (dependencies_generation, dict of resref => position)
+        # See get_include_positions
+        self.include_positions = {}
+
+        # directory => set() of include-only files. Filled by init_include_list
+        self.include_completions = {}
+        # Directories whose include list is complete
+        self.include_scanned_dirs = set()
+        # (directory list, generation) of the running include list scan
+        self.include_scan = None
+        # Incremented to cancel the running include list scan
+        self.include_scan_generation = 0
+        self.include_scan_lock = threading.Lock()
 
     def get_settings_value(self, key: str) -> Any:
         proj = sublime.active_window().project_data()
@@ -201,9 +358,7 @@ class NWScriptCompletion(sublime_plugin.EventListener):
             position = locations[0]
 
         module_path, file_path = self.get_opened_file_paths(view)
-        file_data = view.substr(sublime.Region(0, view.size()))
-
-        include_errors = self.parse_script_tree(module_path, file_path, file_data)
+        include_errors = self.request_parse(view, module_path, file_path)
 
         # Handle #include completions
         row, col = view.rowcol(position)
@@ -244,10 +399,9 @@ class NWScriptCompletion(sublime_plugin.EventListener):
             return
 
         module_path, file_path = self.get_opened_file_paths(view)
-        file_data = view.substr(sublime.Region(0, view.size()))
 
         if self.get_settings_value("parse_on_modified") is True:
-            self.parse_script_tree(module_path, file_path, file_data)
+            self.request_parse(view, module_path, file_path)
 
         if view.substr(point) in ['(', ')'] or point != view.sel()[0].end():
             point -= 1
@@ -258,6 +412,13 @@ class NWScriptCompletion(sublime_plugin.EventListener):
             symbol=view.substr(view.word(point)),
         )
 
+    def on_close(self, view: sublime.View) -> None:
+        # Forget incremental parsing data of the closed buffer
+        _, file_path = self.get_opened_file_paths(view)
+        self.incremental_parsers.pop(file_path, None)
+        self.completion_entries.pop(file_path, None)
+        self.include_errors.pop(file_path, None)
+
     def on_hover(self, view: sublime.View, point: tuple, hover_zone) -> None:
         if hover_zone != sublime.HOVER_TEXT:
             return
@@ -277,9 +438,7 @@ class NWScriptCompletion(sublime_plugin.EventListener):
             return
 
         module_path, file_path = self.get_opened_file_paths(view)
-        file_data = view.substr(sublime.Region(0, view.size()))
-
-        self.parse_script_tree(module_path, file_path, file_data)
+        self.request_parse(view, module_path, file_path)
 
         self.show_doc_popup_for(
             view,
@@ -288,13 +447,37 @@ class NWScriptCompletion(sublime_plugin.EventListener):
         )
 
 
+    # Queue the view content for parsing in the background. The first time a
+    # script is seen, it is parsed right away since there are no completions
+    # to show yet.
+    # Returns the include errors found during the last finished parse
+    def request_parse(self, view: sublime.View, module_path: str, file_path: str) -> list:
+        file_data = view.substr(sublime.Region(0, view.size()))
+
+        if "nwscript" not in self.symbol_completions or self.get_resref(file_path) not in self.symbol_completions:
+            self.parse_buffer(module_path, file_path, file_data)
+        else:
+            self.parse_queue.push(
+                module_path, file_path, file_data,
+                self.get_settings_value("parse_delay") / 1000
+            )
+
+        return self.include_errors.get(file_path, [])
+
+    # Parse the content of a buffer and its dependencies
+    def parse_buffer(self, module_path: str, file_path: str, file_data: str) -> None:
+        with self.parse_lock:
+            self.include_errors[file_path] = self.parse_script_tree(module_path, file_path, file_data)
+
     @staticmethod
     def get_opened_file_paths(view: sublime.View) -> (str, str):
         file_path = view.file_name()
         module_path = None
         if file_path is None:
             file_path = "__unsaved_%d.nss" % view.id()
-            opened_folders = view.window().folders()
+            # The view may not be attached to a window anymore when closed
+            window = view.window()
+            opened_folders = window.folders() if window is not None else []
             if len(opened_folders) > 0:
                 module_path = opened_folders[0]
         else:
@@ -331,102 +514,162 @@ class NWScriptCompletion(sublime_plugin.EventListener):
         return False
 
     def get_documentation(self, resref: str, symbol: str) -> Documentation:
-        explored_resrefs = set()
-
-        def recurr_get_documentation(curr_resref) -> Documentation:
-            if curr_resref not in self.symbol_completions:
-                return None
-            compl = self.symbol_completions[curr_resref]
-
-            if symbol in compl.symbol_list:
-                return compl.documentation[compl.symbol_list[symbol]]
-
-            if symbol in compl.structs_doc:
-                return compl.structs_doc[symbol]
-
-            for dep in compl.dependencies:
-                if dep not in explored_resrefs:
-                    explored_resrefs.add(dep)
-                    doc = recurr_get_documentation(dep)
-                    if doc is not None:
-                        return doc
-
+        definitions = self.symbol_definitions.get(symbol)
+        if definitions is None:
             return None
 
-        explored_resrefs.add("nwscript")
-        doc = recurr_get_documentation("nwscript")
+        # nwscript symbols come first
+        doc = definitions.get("nwscript")
         if doc is not None:
             return doc
 
-        doc = recurr_get_documentation(resref)
-        if doc is not None:
-            return doc
-        return None
+        # Then the first script defining the symbol in the include closure
+        ret = None
+        ret_position = None
+        positions = self.get_include_positions(resref)
+        for def_resref, doc in definitions.items():
+            position = positions.get(def_resref)
+            if position is not None and (ret_position is None or position < ret_position):
+                ret = doc
+                ret_position = position
+        return ret
 
-    def gather_symbol_completions(self, resref: str) -> list:
-        ret = []
+    # Return the position of each script in the include closure of resref, in
+    # lookup order. Memoized until the dependencies of a script change.
+    def get_include_positions(self, resref: str) -> dict:
+        memo = self.include_positions.get(resref)
+        if memo is not None and memo[0] == self.dependencies_generation:
+            return memo[1]
+
+        generation = self.dependencies_generation
+        positions = {
+            curr_resref: i
+            for i, (curr_resref, _) in enumerate(self.get_include_closure(resref, {"nwscript"}))
+        }
+        self.include_positions[resref] = (generation, positions)
+        return positions
+
+    # Update symbol_definitions when the SymbolCompletions of a script is replaced
+    def update_symbol_definitions(self, resref: str, old_compl: SymbolCompletions, new_compl: SymbolCompletions) -> None:
+        def get_script_definitions(compl):
+            if compl is None:
+                return {}
+            ret = dict(compl.structs_doc)
+            for symbol, index in compl.symbol_list.items():
+                ret[symbol] = compl.documentation[index]
+            return ret
+
+        old_docs = get_script_definitions(old_compl)
+        new_docs = get_script_definitions(new_compl)
+
+        # Definition dicts are copied before being modified, so they can be
+        # read from another thread
+        for symbol in old_docs.keys() - new_docs.keys():
+            definitions = dict(self.symbol_definitions[symbol])
+            del definitions[resref]
+            if len(definitions) > 0:
+                self.symbol_definitions[symbol] = definitions
+            else:
+                del self.symbol_definitions[symbol]
 
-        explored_resrefs = set("nwscript")
-        ret.extend(self.symbol_completions["nwscript"].completions)
+        for symbol, doc in new_docs.items():
+            if old_docs.get(symbol) is not doc:
+                definitions = dict(self.symbol_definitions.get(symbol, {}))
+                definitions[resref] = doc
+                self.symbol_definitions[symbol] = definitions
 
-        def recurr_gather_symbol_completions(curr_resref):
-            compl = self.symbol_completions[curr_resref]
-            ret.extend(compl.completions)
+    def gather_symbol_completions(self, resref: str) -> list:
+        return self.get_flattened_completions(
+            ("completions", resref),
+            lambda: (
+                [("nwscript", self.symbol_completions.get("nwscript"))]
+                + self.get_include_closure(resref, {"nwscript"})
+            ),
+            self.get_completions,
+        )
 
-            for dep in compl.dependencies:
-                if dep not in explored_resrefs and dep in self.symbol_completions:
-                    explored_resrefs.add(dep)
-                    recurr_gather_symbol_completions(dep)
+    def gather_struct_completions(self, resref: str) -> list:
+        return self.get_flattened_completions(
+            ("structs", resref),
+            lambda: self.get_include_closure(resref, set()),
+            lambda compl: self.get_completions(compl, structs=True),
+        )
 
-        explored_resrefs.add(resref)
-        recurr_gather_symbol_completions(resref)
+    # Return the concatenated completions of all scripts in an include closure.
+    # The list is memoized, and only built again when one of the scripts of the
+    # closure has been parsed again.
+    #   key: memoization key
+    #   get_closure: function returning the include closure
+    #   get_completions: function returning the completion list of a SymbolCompletions
+    def get_flattened_completions(self, key: tuple, get_closure, get_completions) -> list:
+        memo = self.flattened_completions.get(key)
+        if memo is not None:
+            closure, ret = memo
+            if all(self.symbol_completions.get(resref) is compl for resref, compl in closure):
+                return ret
+
+        closure = get_closure()
+        ret = []
+        for resref, compl in closure:
+            if compl is not None:
+                ret.extend(get_completions(compl))
+        self.flattened_completions[key] = (closure, ret)
         return ret
 
-    def gather_struct_completions(self, resref: str) -> list:
-        ret = []
-        explored_resrefs = set()
+    # List all scripts included by resref recursively, including itself, in
+    # lookup order
+    #   explored_resrefs: scripts to ignore. Modified in place.
+    # Returns a list of (resref, SymbolCompletions), with None if the script
+    # has not been parsed
+    def get_include_closure(self, resref: str, explored_resrefs: set) -> list:
+        closure = []
 
-        def recurr_gather_symbol_completions(curr_resref):
-            compl = self.symbol_completions[curr_resref]
-            ret.extend(compl.structs_completions)
+        def recurr_get_include_closure(curr_resref):
+            compl = self.symbol_completions.get(curr_resref)
+            closure.append((curr_resref, compl))
+            if compl is None:
+                return
 
             for dep in compl.dependencies:
                 if dep not in explored_resrefs:
                     explored_resrefs.add(dep)
-                    recurr_gather_symbol_completions(dep)
+                    recurr_get_include_closure(dep)
 
         explored_resrefs.add(resref)
-        recurr_gather_symbol_completions(resref)
-        return ret
+        recurr_get_include_closure(resref)
+        return closure
 
     # Search through include dirs and module path to find a file matching resref
+    # Results are cached until a file is added to or removed from one of the
+    # directories. Call refresh_include_dirs to detect these changes.
     def find_file_by_resref(self, module_path: str, resref: str) -> str:
-        path_list = []
-        if module_path is not None:
-            path_list.append(module_path)
-        path_list.extend(self.get_settings_value("include_path"))
+        path_list = self.get_include_dirs(module_path)
+        dir_mtimes = [dirscan.get_script_dir(path).mtime for path in path_list]
 
-        for path in path_list:
-            file = os.path.join(path, resref + ".nss")
-            if os.path.isfile(file):
-                return file
+        key = (module_path, resref.lower())
+        cached = self.resolved_files.get(key)
+        if cached is not None and cached[0] == path_list and cached[1] == dir_mtimes:
+            return cached[2]
 
-            if os.name == "posix":
-                file = os.path.join(path, resref + ".NSS")
-                if os.path.isfile(file):
-                    return file
+        file = dirscan.find_nss(path_list, resref, refresh=False)
+        self.resolved_files[key] = (path_list, dir_mtimes, file)
+        if file is None:
+            print("nwscript-completion: could not find '" + resref + "' in ", path_list)
+        return file
 
-        print("nwscript-completion: could not find '" + resref + "' in ", path_list)
-        return None
+    # Scan again the module and include directories that have changed
+    def refresh_include_dirs(self, module_path: str) -> None:
+        for path in self.get_include_dirs(module_path):
+            dirscan.get_script_dir(path).refresh()
 
 
     # Parse a script and its dependencies if they have been modified since last call
     # Returns a list of include errors
     def parse_script_tree(self, module_path: str, file_path: str, file_data: str = None) -> []:
-        if self.include_completions is None:
-            self.init_include_list(module_path)
+        self.init_include_list(module_path)
+        self.refresh_include_dirs(module_path)
 
-        explored_resrefs = set("nwscript")
+        explored_resrefs = {"nwscript"}
         if "nwscript" not in self.symbol_completions:
             self.parse_script(self.find_file_by_resref(module_path, "nwscript"))
 
@@ -438,6 +681,8 @@ class NWScriptCompletion(sublime_plugin.EventListener):
 
             if do_not_parse is False and (compl is None or os.path.getmtime(file) > compl.mtime):
                 resref, compl = self.parse_script(file)
+            else:
+                self.symbol_completions.move_to_end(resref)
 
             for dep in compl.dependencies:
                 if dep not in explored_resrefs:
@@ -456,221 +701,412 @@ class NWScriptCompletion(sublime_plugin.EventListener):
         else:
             recurr_parse(file_path)
 
+        self.evict_symbol_completions()
         return include_errors
 
+    # Forget the least recently used scripts, so there are at most
+    # completion_cache_size scripts in symbol_completions besides the pinned
+    # ones: nwscript and the include closures of the opened scripts.
+    # Forgotten scripts are parsed again when needed.
+    def evict_symbol_completions(self) -> None:
+        max_size = self.get_settings_value("completion_cache_size")
+        if max_size is None or len(self.symbol_completions) <= max_size:
+            return
+
+        pinned = self.get_pinned_resrefs()
+        evictable = [resref for resref in self.symbol_completions if resref not in pinned]
+        for resref in evictable[:max(0, len(evictable) - max_size)]:
+            compl = self.symbol_completions.pop(resref)
+            self.update_symbol_definitions(resref, compl, None)
+        self.dependencies_generation += 1
+
+        # Memoized lookups are only used by the opened scripts
+        for key in list(self.flattened_completions):
+            if key[1] not in pinned:
+                del self.flattened_completions[key]
+        for resref in list(self.include_positions):
+            if resref not in pinned:
+                del self.include_positions[resref]
+
+    # Return a text report of the scripts kept in symbol_completions and the
+    # approximate memory they use
+    def get_stats_report(self) -> str:
+        pinned = self.get_pinned_resrefs()
+        seen = set()
+        script_sizes = sorted(
+            [
+                (get_approx_size(compl, seen), len(compl.completion_decls), resref in pinned, resref)
+                for resref, compl in list(self.symbol_completions.items())
+            ],
+            reverse=True
+        )
+        scripts_size = sum(entry[0] for entry in script_sizes)
+        store = metadata.get_store()
+        with store.lock:
+            store_scripts = dict(store.scripts)
+        other_sizes = [
+            ("Symbol definitions", len(self.symbol_definitions), get_approx_size(self.symbol_definitions, seen)),
+            ("Memoized completion lists", len(self.flattened_completions), get_approx_size(self.flattened_completions, seen)),
+            ("Memoized include positions", len(self.include_positions), get_approx_size(self.include_positions, seen)),
+            ("Edited scripts entries", len(self.completion_entries), get_approx_size(self.completion_entries, seen)),
+            ("Shared script metadata", len(store_scripts), get_approx_size(store_scripts, seen)),
+        ]
+        pinned_count = sum(1 for entry in script_sizes if entry[2])
+
+        text = "NWScript completion cache\n\n"
+        text += "Scripts: %d (%d pinned, %d evictable, limit %s)\n" % (
+            len(script_sizes), pinned_count, len(script_sizes) - pinned_count,
+            self.get_settings_value("completion_cache_size"),
+        )
+        text += "%-30s %8s %10s\n" % ("", "Entries", "Size (KiB)")
+        text += "%-30s %8d %10.1f\n" % ("Scripts", len(script_sizes), scripts_size / 1024)
+        for name, count, size in other_sizes:
+            text += "%-30s %8d %10.1f\n" % (name, count, size / 1024)
+        text += "%-30s %8s %10.1f\n" % ("Total", "", (scripts_size + sum(e[2] for e in other_sizes)) / 1024)
+
+        text += "\nLargest scripts:\n"
+        text += "%10s %12s %7s  %s\n" % ("Size (KiB)", "Completions", "Pinned", "Script")
+        for size, completion_count, is_pinned, resref in script_sizes[:50]:
+            text += "%10.1f %12d %7s  %s\n" % (size / 1024, completion_count, "yes" if is_pinned else "", resref)
+        return text
+
+    # Return the resrefs of nwscript and of the scripts included by the
+    # scripts opened in Sublime Text
+    def get_pinned_resrefs(self) -> set:
+        pinned = {"nwscript"}
+        for window in sublime.windows():
+            for view in window.views():
+                if not view.scope_name(0).startswith("source.nss"):
+                    continue
+                _, file_path = self.get_opened_file_paths(view)
+                self.get_include_closure(self.get_resref(file_path), pinned)
+        return pinned
+
 
     # Parse a single script and extract completion info
     def parse_script(self, file_path: str, file_data: str = None) -> None:
-        if file_data is None:
-            file_data = open(file_path, encoding="utf-8", errors="ignore").read()
+        resref = self.get_resref(file_path)
+        is_nwscript = resref == "nwscript"
+
+        doc_fixes = None
+        if file_data is None and is_nwscript:
+            # Use the precompiled index, to avoid parsing this large file
             file_mtime = os.path.getmtime(file_path)
+            with open(file_path, "rb") as file:
+                raw_data = file.read()
+            index = self.get_symbol_index(raw_data, resref)
+            decls, has_main, doc_fixes = index.declarations, index.has_main, index.doc_fixes
+            entries = None
+        elif file_data is None:
+            # Declarations are only kept in symbol_completions, so the script
+            # is read again. This also refreshes the shared metadata.
+            script, decls = metadata.get_store().read(file_path)
+            file_mtime = script.mtime
+            has_main = script.has_main
+            entries = None
         else:
+            # Script is being edited: only parse what changed since last time
             file_mtime = time.time()
+            incremental_parser = self.incremental_parsers.get(file_path)
+            if incremental_parser is None:
+                incremental_parser = parser.IncrementalParser(is_nwscript)
+                self.incremental_parsers[file_path] = incremental_parser
+            decls, has_main = incremental_parser.parse(file_data)
+            entries = self.completion_entries.get(file_path, {})
 
         compl = SymbolCompletions()
         compl.file = file_path
+        compl.resref = resref
         compl.mtime = file_mtime
-        compl.dependencies = self.rgx_include.findall(file_data)
-        compl.completions = []
-        compl.documentation = []
-        compl.symbol_list = {}
-        has_main = False
-
-        resref = self.get_resref(file_path)
-        custom_mark = "⋄" if resref != "nwscript" else ""
+        compl.dependencies = parser.get_includes(decls)
+
+        # Documentation fixes from the settings, and from doc_fixes or
+        # nwscript_doc_fixes.get_doc_fix
+        user_fixes = self.get_settings_value("doc_fixes").get(resref, {})
+        def get_fix(fun_name):
+            fix = user_fixes.get(fun_name)
+            if fix is None:
+                fix = doc_fixes.get(fun_name) if doc_fixes is not None else get_doc_fix(resref, fun_name)
+            return fix
+
+        # Documentation objects are reused when a script being edited is
+        # parsed again, so symbol_definitions only changes for modified
+        # declarations
+        new_entries = {}
+        def get_doc(decl):
+            if entries is None:
+                return Documentation(decl, resref, get_fix(decl[2]) if decl[0] == "f" else None, decl[-1])
+            entry = new_entries.get(decl)
+            if entry is None:
+                entry = entries.get(decl)
+                if entry is None:
+                    entry = CompletionEntry(
+                        Documentation(decl, resref, get_fix(decl[2]) if decl[0] == "f" else None, decl[-1])
+                    )
+                new_entries[decl] = entry
+            return entry.doc
 
         # Function completion
-        for (fun_doc, fun_type, fun_name, fun_args) in self.rgx_fun.findall(file_data):
-            if fun_name in ("main", "StartingConditional"):
-                has_main = True
+        for decl in decls:
+            if decl[0] != "f":
+                continue
+            fun_name = decl[2]
+            if fun_name not in compl.symbol_list:
+                # Register new symbol
+                compl.symbol_list[fun_name] = len(compl.completion_decls)
+                compl.completion_decls.append(decl)
+                compl.documentation.append(get_doc(decl))
             else:
-                if fun_name not in compl.symbol_list:
-                    # Register new symbol
-
-                    # Parse function arguments
-                    args = []
-                    args_comp_list = []
-                    i = 0
-                    if fun_args != "" and not fun_args.isspace():
-                        for (arg_type, arg_name, arg_value) in self.rgx_fun_arg.findall(fun_args):
-                            default = ""
-                            if arg_value != "" and not arg_value.isspace():
-                                default += "=" + arg_value
-                            else:
-                                arg_value = None
-                            args.append((arg_type, arg_name, arg_value))
-                            args_comp_list.append("${%d:%s %s}" % (i + 1, arg_type, arg_name + default))
-
-                            i += 1
-
-                    # Add completion
-                    compl.symbol_list[fun_name] = len(compl.completions)
-                    if self.st4:
-                        compl.completions.append(
-                            sublime.CompletionItem(
-                                trigger=fun_name,
-                                annotation=custom_mark + fun_type,
-                                completion="%s(%s)" % (fun_name, ", ".join(args_comp_list)),
-                                completion_format=sublime.COMPLETION_FORMAT_SNIPPET,
-                                kind=sublime.KIND_FUNCTION,
-                                details="Defined in " + resref
-                            )
-                        )
-                    else:
-                        compl.completions.append([
-                            "%s\t%s%s()" % (fun_name, custom_mark, fun_type),
-                            "%s(%s)" % (fun_name, ", ".join(args_comp_list))
-                        ])
-
-                    doc = Documentation()
-                    doc.signature = ("f", fun_type, fun_name, args)
-                    doc.script_resref = resref
-                    doc.fix = self.get_settings_value("doc_fixes").get(resref, {}).get(fun_name, None)
-                    if doc.fix is None:
-                        doc.fix = get_doc_fix(resref, fun_name)
-
-                    doc.text = self.remove_comments(fun_doc)
-                    compl.documentation.append(doc)
-                else:
-                    # Set documentation if none
-                    existing_index = compl.symbol_list[fun_name]
-                    existing_doc = compl.documentation[existing_index]
-                    if existing_doc.text is None:
-                        existing_doc.text = self.remove_comments(fun_doc)
+                # Set documentation if none
+                existing_index = compl.symbol_list[fun_name]
+                existing_doc = compl.documentation[existing_index]
+                if existing_doc.text is None and decl[4] is not None:
+                    compl.documentation[existing_index] = Documentation(
+                        existing_doc.decl, existing_doc.script_resref, existing_doc.fix, decl[4]
+                    )
 
-        # const completions
-        glob_rgx = self.rgx_global_nwscript if resref == "nwscript" else self.rgx_global_const
-        for (glob_type, glob_name, glob_value, glob_doc) in glob_rgx.findall(file_data):
-            compl.symbol_list[glob_name] = len(compl.completions)
+        # const and #define completions
+        for kind in ("c", "d"):
+            for decl in decls:
+                if decl[0] != kind:
+                    continue
+                compl.symbol_list[decl[2] if kind == "c" else decl[1]] = len(compl.completion_decls)
+                compl.completion_decls.append(decl)
+                compl.documentation.append(get_doc(decl))
 
+        # struct completions
+        for decl in decls:
+            if decl[0] != "s":
+                continue
             if self.st4:
-                compl.completions.append(
-                    sublime.CompletionItem(
-                        trigger=glob_name,
-                        annotation=custom_mark + glob_type + "=" + glob_value,
-                        completion=glob_name,
-                        completion_format=sublime.COMPLETION_FORMAT_TEXT,
-                        kind=(sublime.KIND_ID_VARIABLE, "c", "Constant"),
-                        details="Defined in " + resref
-                    )
-                )
+                compl.completion_decls.append(decl)
             else:
-                compl.completions.append(["%s\t%s%s=%s" % (glob_name, custom_mark, glob_type, glob_value), glob_name])
-            doc = Documentation()
-            doc.signature = ("c", glob_type, glob_name, glob_value)
-            doc.script_resref = resref
-            doc.text = (
-                glob_doc
-                if glob_doc != "" and not glob_doc.isspace()
-                else None
+                compl.struct_decls.append(decl)
+            compl.structs_doc[decl[1]] = get_doc(decl)
+
+        if entries is not None:
+            self.completion_entries[file_path] = new_entries
+
+        # update include completions
+        file_dir = os.path.dirname(file_path)
+        if file_dir in self.include_completions:
+            if has_main:
+                self.include_completions[file_dir].discard(resref)
+            else:
+                self.include_completions[file_dir].add(resref)
+
+        old_compl = self.symbol_completions.get(resref)
+        self.update_symbol_definitions(resref, old_compl, compl)
+        if old_compl is None or old_compl.dependencies != compl.dependencies:
+            self.dependencies_generation += 1
+        self.symbol_completions[resref] = compl
+        self.symbol_completions.move_to_end(resref)
+        return (resref, compl)
+
+    # Hash of nwscript_doc_fixes.py, so symbol indexes are rebuilt when the
+    # documentation fixes shipped with the package change
+    doc_fixes_sha1 = None
+
+    def get_doc_fixes_sha1(self) -> str:
+        if NWScriptCompletion.doc_fixes_sha1 is None:
+            try:
+                source = sublime.load_resource("Packages/%s/nwscript_doc_fixes.py" % __package__)
+            except OSError:
+                source = ""
+            NWScriptCompletion.doc_fixes_sha1 = get_doc_fixes_hash(source)
+        return NWScriptCompletion.doc_fixes_sha1
+
+    # Return the symbol index of a script, from the index shipped with the
+    # package or the one stored in the cache. The script is parsed and the
+    # cached index updated if none matches the script content.
+    def get_symbol_index(self, raw_data: bytes, resref: str) -> SymbolIndex:
+        sha1 = get_data_hash(raw_data)
+        doc_fixes_sha1 = self.get_doc_fixes_sha1()
+
+        try:
+            index = SymbolIndex.from_json(
+                sublime.load_resource("Packages/%s/%s_index.json" % (__package__, resref)),
+                sha1,
+                doc_fixes_sha1
             )
-            compl.documentation.append(doc)
+            if index is not None:
+                return index
+        except OSError:
+            pass
+
+        index_file = os.path.join(sublime.cache_path(), "STNeverwinterScript", resref + "_index.json")
+        index = SymbolIndex.load(index_file, sha1, doc_fixes_sha1)
+        if index is None:
+            index = SymbolIndex.build(raw_data, resref, get_doc_fix, doc_fixes_sha1)
+            try:
+                index.save(index_file)
+            except OSError as e:
+                print("nwscript-completion: could not save symbol index: %s" % e)
+        return index
+
+    # Create the completion item of a declaration returned by nwscript_tools.parser
+    def make_completion(self, resref: str, decl: tuple) -> Any:
+        custom_mark = "⋄" if resref != "nwscript" else ""
+
+        if decl[0] == "f":
+            _, fun_type, fun_name, args, _ = decl
+            args_comp_list = [
+                "${%d:%s %s}" % (i + 1, arg_type, arg_name + ("=" + arg_value if arg_value is not None else ""))
+                for i, (arg_type, arg_name, arg_value) in enumerate(args)
+            ]
 
-        # #define completions
-        for (def_doc, def_name, def_value) in self.rgx_define.findall(file_data):
-            compl.symbol_list[def_name] = len(compl.completions)
             if self.st4:
-                compl.completions.append(
-                    sublime.CompletionItem(
-                        trigger=def_name,
-                        annotation=custom_mark + def_value,
-                        completion=def_name,
-                        completion_format=sublime.COMPLETION_FORMAT_TEXT,
-                        kind=(sublime.KIND_ID_VARIABLE, "d", "Define"),
-                        details="Defined in " + resref
-                    )
+                completion = sublime.CompletionItem(
+                    trigger=fun_name,
+                    annotation=custom_mark + fun_type,
+                    completion="%s(%s)" % (fun_name, ", ".join(args_comp_list)),
+                    completion_format=sublime.COMPLETION_FORMAT_SNIPPET,
+                    kind=sublime.KIND_FUNCTION,
+                    details="Defined in " + resref
                 )
             else:
-                compl.completions.append(["%s\t%s%s" % (def_name, custom_mark, def_value), def_name])
-            doc = Documentation()
-            doc.signature = ("d", def_name, def_value)
-            doc.script_resref = resref
-            doc.text = (
-                "\n".join([line[2:] for line in def_doc.splitlines()])
-                if def_doc != "" and not def_doc.isspace()
-                else None
-            )
-            compl.documentation.append(doc)
+                completion = [
+                    "%s\t%s%s()" % (fun_name, custom_mark, fun_type),
+                    "%s(%s)" % (fun_name, ", ".join(args_comp_list))
+                ]
 
-        # struct completions
-        for (struct_doc, struct_name) in self.rgx_struct.findall(file_data):
+
+        elif decl[0] == "c":
+            _, glob_type, glob_name, glob_value, _ = decl
             if self.st4:
-                compl.completions.append(
-                    sublime.CompletionItem(
-                        trigger=struct_name,
-                        annotation=custom_mark + "struct",
-                        completion=struct_name,
-                        completion_format=sublime.COMPLETION_FORMAT_TEXT,
-                        kind=sublime.KIND_TYPE,
-                        details="Defined in " + resref
-                    )
+                completion = sublime.CompletionItem(
+                    trigger=glob_name,
+                    annotation=custom_mark + glob_type + "=" + glob_value,
+                    completion=glob_name,
+                    completion_format=sublime.COMPLETION_FORMAT_TEXT,
+                    kind=(sublime.KIND_ID_VARIABLE, "c", "Constant"),
+                    details="Defined in " + resref
                 )
             else:
-                compl.structs_completions.append(["%s\t%sstruct" % (struct_name, custom_mark), struct_name])
-            doc = Documentation()
-            doc.signature = ("s", struct_name)
-            doc.script_resref = resref
-            doc.text = self.remove_comments(struct_doc)
-            compl.structs_doc[struct_name] = doc
+                completion = ["%s\t%s%s=%s" % (glob_name, custom_mark, glob_type, glob_value), glob_name]
 
-        # update include completions
-        if self.include_completions is not None:
-            file_dir = os.path.dirname(file_path)
-            if file_dir in self.include_completions:
-                if has_main:
-                    self.include_completions[file_dir].discard(resref)
-                else:
-                    self.include_completions[file_dir].add(resref)
+        elif decl[0] == "d":
+            _, def_name, def_value, _ = decl
+            if self.st4:
+                completion = sublime.CompletionItem(
+                    trigger=def_name,
+                    annotation=custom_mark + def_value,
+                    completion=def_name,
+                    completion_format=sublime.COMPLETION_FORMAT_TEXT,
+                    kind=(sublime.KIND_ID_VARIABLE, "d", "Define"),
+                    details="Defined in " + resref
+                )
+            else:
+                completion = ["%s\t%s%s" % (def_name, custom_mark, def_value), def_name]
 
-        self.symbol_completions[resref] = compl
-        return (resref, compl)
+        else:
+            _, struct_name, _ = decl
+            if self.st4:
+                completion = sublime.CompletionItem(
+                    trigger=struct_name,
+                    annotation=custom_mark + "struct",
+                    completion=struct_name,
+                    completion_format=sublime.COMPLETION_FORMAT_TEXT,
+                    kind=sublime.KIND_TYPE,
+                    details="Defined in " + resref
+                )
+            else:
+                completion = ["%s\t%sstruct" % (struct_name, custom_mark), struct_name]
+
+        return completion
+
+    # Return the completion items of a script, creating them on first use
+    #   structs: True for the ST3 struct completions
+    def get_completions(self, compl: SymbolCompletions, structs: bool = False) -> list:
+        completions = compl.structs_completions if structs else compl.completions
+        if completions is not None:
+            return completions
+
+        # Items of a script being edited are reused between parses
+        entries = self.completion_entries.get(compl.file)
+        completions = []
+        for decl in (compl.struct_decls if structs else compl.completion_decls):
+            entry = entries.get(decl) if entries is not None else None
+            if entry is None:
+                completions.append(self.make_completion(compl.resref, decl))
+            else:
+                if entry.completion is None:
+                    entry.completion = self.make_completion(compl.resref, decl)
+                completions.append(entry.completion)
 
-    @staticmethod
-    def remove_comments(comm: str):
-        if comm == "" or comm.isspace():
-            return None
-        return "\n".join([
-            (line[3:] if len(line) > 2 and line[2] == ' ' else line[2:])
-            for line in comm.splitlines()
-        ])
+        if structs:
+            compl.structs_completions = completions
+        else:
+            compl.completions = completions
+        return completions
 
 
+    def get_include_dirs(self, module_path: str) -> list:
+        path_list = []
+        if module_path is not None:
+            path_list.append(module_path)
+        path_list.extend(self.get_settings_value("include_path"))
+        return path_list
+
+    # Start listing the scripts that can be included, in a side thread.
+    # Results are added to include_completions as they are found.
     def init_include_list(self, module_path):
-        if self.include_completions is not None and module_path in self.include_completions:
-            return
+        path_list = self.get_include_dirs(module_path)
 
-        sublime.active_window().status_message("Building #include completions...")
+        with self.include_scan_lock:
+            if all(dir_path in self.include_scanned_dirs for dir_path in path_list):
+                return
+            if self.include_scan is not None and self.include_scan[0] == path_list:
+                # Already scanning these directories
+                return
 
-        def worker():
-            self.include_completions = {}
+            # Cancel the scan of another module
+            self.include_scan_generation += 1
+            generation = self.include_scan_generation
+            self.include_scan = (path_list, generation)
 
-            path_list = []
-            if module_path is not None:
-                path_list.append(module_path)
-            path_list.extend(self.get_settings_value("include_path"))
+        sublime.active_window().status_message("Building #include completions...")
 
-            for dir_path in path_list:
-                # Don't go through already parsed folders
-                if dir_path in self.include_completions:
-                    continue
+        def is_cancelled():
+            return self.include_scan_generation != generation
 
-                self.include_completions[dir_path] = set()
+        def scan_file(file_path, file_stat, resref, includes):
+            if is_cancelled():
+                return
+            try:
+                if not metadata.get_store().get_has_main(file_path, file_stat):
+                    includes.add(resref)
+            except OSError:
+                pass
 
-                for file_name in os.listdir(dir_path):
-                    if os.path.splitext(file_name)[1].lower() != ".nss":
-                        continue
-                    file_path = os.path.join(dir_path, file_name)
-                    if not os.path.isfile(file_path):
+        def worker():
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+                for dir_path in path_list:
+                    # Don't go through already parsed folders
+                    if dir_path in self.include_scanned_dirs:
                         continue
 
-                    with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                        data = f.read()
-                        data = self.rgx_comment.sub("", data)
-                        has_main = self.rgx_main.search(data) is not None
-
-                        if not has_main:
-                            self.include_completions[dir_path].add(os.path.splitext(file_name)[0])
+                    includes = set()
+                    self.include_completions[dir_path] = includes
 
+                    futures = [
+                        executor.submit(
+                            scan_file,
+                            os.path.join(dir_path, file_name), file_stat,
+                            os.path.splitext(file_name)[0], includes
+                        )
+                        for file_name, file_stat in dirscan.get_script_dir(dir_path).scan().items()
+                        if os.path.splitext(file_name)[1].lower() == ".nss"
+                    ]
+                    concurrent.futures.wait(futures)
+
+                    if is_cancelled():
+                        return
+                    self.include_scanned_dirs.add(dir_path)
+
+            with self.include_scan_lock:
+                if self.include_scan is not None and self.include_scan[1] == generation:
+                    self.include_scan = None
             sublime.active_window().status_message("Building #include completions... Done !")
 
         threading.Thread(
@@ -678,13 +1114,22 @@ class NWScriptCompletion(sublime_plugin.EventListener):
             args=()
         ).start()
 
+    # Cancel the include list scan if it is not for the current module
+    def on_activated_async(self, view: sublime.View) -> None:
+        if not view.scope_name(0).startswith("source.nss"):
+            return
+        with self.include_scan_lock:
+            if self.include_scan is None:
+                return
+            module_path, _ = self.get_opened_file_paths(view)
+            if self.include_scan[0] != self.get_include_dirs(module_path):
+                self.include_scan_generation += 1
+                self.include_scan = None
+
     def get_include_completions(self, module_path):
         self.init_include_list(module_path)
 
-        path_list = []
-        if module_path is not None:
-            path_list.append(module_path)
-        path_list.extend(self.get_settings_value("include_path"))
+        path_list = self.get_include_dirs(module_path)
 
         ret = []
         for path in path_list:
@@ -700,61 +1145,32 @@ class NWScriptCompletion(sublime_plugin.EventListener):
                             completion_format=sublime.COMPLETION_FORMAT_TEXT,
                             kind=sublime.KIND_NAMESPACE
                         )
-                        for resref in self.include_completions[path]
+                        for resref in list(self.include_completions[path])
                         if resref != "nwscript"
                     ])
                 else:
                     ret.extend([
                         ["%s\t%sscript" % (resref, mark), resref]
-                        for resref in self.include_completions[path]
+                        for resref in list(self.include_completions[path])
                         if resref != "nwscript"
                     ])
         return ret
 
 
-    nwn_types = r'(void|string|int|float|object|vector|location|effect|event|talent|itemproperty|action|sqlquery|json|struct\s+\w+)'
-    rgx_fun = re.compile(
-        r'((?:^[ \t]*//[^\n]*?\n)*)'
-        r'^[ \t]*' + nwn_types + r'\s+'
-        r'(\w+)\s*'
-        r'\(([^)]*?)\)\s*[;\{]',
-        re.DOTALL | re.MULTILINE)
-
-    rgx_fun_arg = re.compile(
-        nwn_types + r'\s+'
-        r'(\w+)'
-        r'(?:\s*=\s*(".*?"|\[.*?\]|[-\w\."]+))?',
-        re.DOTALL)
-
-    rgx_global_const = re.compile(
-        r'^\s*const\s+'
-        + nwn_types + r'\s+'
-        r'(\w+)'
-        r'\s*=\s*(.+?)\s*;(?:\s*//\s*(.*?)$)?',
-        re.DOTALL | re.MULTILINE)
-    rgx_global_nwscript = re.compile(
-        r'^\s*' + nwn_types + r'\s+'
-        r'(\w+)'
-        r'\s*=\s*(.+?)\s*;(?:\s*//\s*(.*?)$)?',
-        re.DOTALL | re.MULTILINE)
-
-    rgx_struct = re.compile(r'((?:^[ \t]*//[^\n]*?\n)*)^[ \t]*struct\s+(\w+)\s*\{', re.DOTALL | re.MULTILINE)
-
-    rgx_define = re.compile(
-        r'((?:^[ \t]*//[^\n]*?\n)*)'
-        r'^\s*#\s*define\s+(\w+)\s+(.+?)\s*$',
-        re.DOTALL | re.MULTILINE)
-
-    rgx_include = re.compile(
-        r'^(?!\s*//)\s*#include\s+"([\w-]+)"',
-        re.MULTILINE)
-
-    rgx_comment = re.compile(r'/\*.*?\*/|//[^\n]*', re.DOTALL)
     rgx_include_partial = re.compile(
         r'^(?!\s*//)\s*#include\s+"([\w-]*)',
         re.MULTILINE)
-    rgx_main = re.compile(
-        r'^[ \t]*(?:int|void)\s+'
-        r'(main|StartingConditional)\s*'
-        r'\(([^)]*?)\)\s*\{',
-        re.DOTALL | re.MULTILINE)
+
+
+# Open a new view listing the scripts kept for completions and their memory usage
+class nwscript_completion_stats(sublime_plugin.WindowCommand):
+    def run(self):
+        if NWScriptCompletion.instance is None:
+            return
+        text = NWScriptCompletion.instance.get_stats_report()
+
+        view = self.window.new_file()
+        view.set_name("NWScript completion cache")
+        view.set_scratch(True)
+        view.run_command("append", {"characters": text})
+        view.set_read_only(True)
@@ -0,0 +1,236 @@
+import sublime
+import sublime_plugin
+
+import threading
+import os
+from typing import Any
+from .nwscript_tools.project_index import ProjectIndex
+
+# Project-wide symbol index: go to definition, find usages and symbol search
+# across all scripts of the module and include paths
+
+
+def plugin_loaded():
+    settings = sublime.load_settings('nwscript.sublime-settings')
+    nwscript_symbols.settings = settings
+    nwscript_symbols.cache_dir = os.path.join(sublime.cache_path(), "STNeverwinterScript")
+
+
+class nwscript_symbols:
+    settings = None
+    cache_dir = None
+
+    # (module path, include paths) => ProjectIndex
+    indexes = {}
+    indexes_lock = threading.Lock()
+    # (window id, index key) of the windows that already scanned an index
+    scanned_windows = set()
+
+    @staticmethod
+    def get_settings_value(window: sublime.Window, key: str) -> Any:
+        proj = window.project_data() if window is not None else None
+        for k in ("settings", "nwscript", key):
+            if proj is not None:
+                proj = proj.get(k)
+        if proj is not None:
+            return proj
+
+        return nwscript_symbols.settings.get(key)
+
+    @staticmethod
+    def get_module_path(view: sublime.View) -> str:
+        file_path = view.file_name()
+        if file_path is not None:
+            return os.path.dirname(file_path)
+        window = view.window()
+        if window is not None and len(window.folders()) > 0:
+            return window.folders()[0]
+        return None
+
+    # Return the index of the module containing the view. The first time the
+    # index is used in a window, modified scripts are scanned in a side thread.
+    # Afterwards only saved scripts are scanned again, see
+    # NWScriptSymbolsListener.on_post_save_async
+    @staticmethod
+    def get_index(view: sublime.View) -> ProjectIndex:
+        if view is None:
+            return None
+        window = view.window()
+        if nwscript_symbols.get_settings_value(window, "symbol_index") is not True:
+            return None
+
+        directories = []
+        module_path = nwscript_symbols.get_module_path(view)
+        if module_path is not None:
+            directories.append(module_path)
+        directories.extend(nwscript_symbols.get_settings_value(window, "include_path"))
+
+        key = tuple(directories)
+        window_key = (window.id() if window is not None else None, key)
+        with nwscript_symbols.indexes_lock:
+            index = nwscript_symbols.indexes.get(key)
+            if index is None:
+                index = ProjectIndex(directories, nwscript_symbols.cache_dir)
+                nwscript_symbols.indexes[key] = index
+            if window_key in nwscript_symbols.scanned_windows:
+                return index
+            nwscript_symbols.scanned_windows.add(window_key)
+
+        def worker():
+            if not index.ready:
+                sublime.status_message("Indexing NWScript symbols...")
+            index.update()
+            sublime.status_message("Indexing NWScript symbols... Done !")
+
+        threading.Thread(target=worker).start()
+        return index
+
+    @staticmethod
+    def is_nwscript(view: sublime.View) -> bool:
+        return view is not None and view.scope_name(0).startswith("source.nss")
+
+    # Show a list of (file path, line, column) locations in a quick panel,
+    # previewing the highlighted one
+    @staticmethod
+    def show_locations(window: sublime.Window, locations: list, captions: list) -> None:
+        if len(locations) == 1:
+            nwscript_symbols.open_location(window, locations[0])
+            return
+
+        view = window.active_view()
+        initial_selection = list(view.sel()) if view is not None else []
+
+        def on_done(index):
+            if index >= 0:
+                nwscript_symbols.open_location(window, locations[index])
+            elif view is not None:
+                window.focus_view(view)
+                view.sel().clear()
+                view.sel().add_all(initial_selection)
+                view.show(view.sel())
+
+        window.show_quick_panel(
+            captions,
+            on_done,
+            on_highlight=lambda index: nwscript_symbols.open_location(window, locations[index], sublime.TRANSIENT),
+        )
+
+    @staticmethod
+    def open_location(window: sublime.Window, location: tuple, flags: int = 0) -> None:
+        file_path, line, column = location[:3]
+        window.open_file("%s:%d:%d" % (file_path, line, column), sublime.ENCODED_POSITION | flags)
+
+
+# Return the word under the cursor of the active view
+def get_selected_symbol(window: sublime.Window) -> str:
+    view = window.active_view()
+    if view is None or len(view.sel()) == 0:
+        return None
+    return view.substr(view.word(view.sel()[0].begin()))
+
+
+class nwscript_goto_definition(sublime_plugin.WindowCommand):
+    def run(self, symbol=None):
+        index = nwscript_symbols.get_index(self.window.active_view())
+        if index is None:
+            return
+        if not index.ready:
+            sublime.status_message("NWScript symbol index is not ready yet")
+            return
+
+        if symbol is None:
+            symbol = get_selected_symbol(self.window)
+        locations = index.find_definitions(symbol)
+        if len(locations) == 0:
+            sublime.status_message("No definition found for '%s'" % symbol)
+            return
+
+        nwscript_symbols.show_locations(
+            self.window,
+            locations,
+            [
+                [symbol, "%s:%d" % (os.path.basename(file_path), line)]
+                for file_path, line, _, _ in locations
+            ],
+        )
+
+
+class nwscript_find_references(sublime_plugin.WindowCommand):
+    def run(self, symbol=None):
+        index = nwscript_symbols.get_index(self.window.active_view())
+        if index is None:
+            return
+        if not index.ready:
+            sublime.status_message("NWScript symbol index is not ready yet")
+            return
+
+        if symbol is None:
+            symbol = get_selected_symbol(self.window)
+        locations = index.find_references(symbol)
+        if len(locations) == 0:
+            sublime.status_message("No usage found for '%s'" % symbol)
+            return
+
+        nwscript_symbols.show_locations(
+            self.window,
+            locations,
+            [
+                ["%s:%d" % (os.path.basename(file_path), line), os.path.dirname(file_path)]
+                for file_path, line, _ in locations
+            ],
+        )
+
+
+class nwscript_goto_symbol(sublime_plugin.WindowCommand):
+    def run(self):
+        index = nwscript_symbols.get_index(self.window.active_view())
+        if index is None:
+            return
+        if not index.ready:
+            sublime.status_message("NWScript symbol index is not ready yet")
+            return
+
+        symbol_list = index.get_symbol_list()
+        nwscript_symbols.show_locations(
+            self.window,
+            [(file_path, line, column) for _, _, file_path, line, column in symbol_list],
+            [
+                [name, "%s %s:%d" % (kind, os.path.basename(file_path), line)]
+                for name, kind, file_path, line, _ in symbol_list
+            ],
+        )
+
+
+class NWScriptSymbolsListener(sublime_plugin.EventListener):
+    # Replace Sublime Text goto definition / reference commands in NWScript files
+    def on_window_command(self, window: sublime.Window, command_name: str, args: dict):
+        if command_name not in ("goto_definition", "goto_reference"):
+            return None
+        if not nwscript_symbols.is_nwscript(window.active_view()):
+            return None
+        if nwscript_symbols.get_settings_value(window, "symbol_index") is not True:
+            return None
+
+        if command_name == "goto_definition":
+            return ("nwscript_goto_definition", None)
+        return ("nwscript_find_references", None)
+
+    # Load the index and scan modified scripts, once per window
+    def on_activated_async(self, view: sublime.View):
+        if nwscript_symbols.is_nwscript(view) and view.file_name() is not None:
+            nwscript_symbols.get_index(view)
+
+    def on_post_save_async(self, view: sublime.View):
+        if not nwscript_symbols.is_nwscript(view):
+            return
+        index = nwscript_symbols.get_index(view)
+        if index is not None:
+            # May wait for a running update
+            threading.Thread(target=index.update_file, args=(view.file_name(),)).start()
+
+    def on_pre_close_window(self, window: sublime.Window):
+        with nwscript_symbols.indexes_lock:
+            nwscript_symbols.scanned_windows = set(
+                window_key for window_key in nwscript_symbols.scanned_windows
+                if window_key[0] != window.id()
+            )
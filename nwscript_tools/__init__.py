@@ -0,0 +1 @@
+# Editor-independent tools shared by the Sublime Text plugins
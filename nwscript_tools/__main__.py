@@ -0,0 +1,168 @@
+import argparse
+import importlib.util
+import json
+import os
+import re
+import sys
+from typing import Any
+
+from . import build
+from .symbol_index import SymbolIndex, get_doc_fixes_hash
+
+# Command line interface for building a module without Sublime Text
+#
+# Usage examples:
+#   python -m nwscript_tools build --smart path/to/module
+#   python -m nwscript_tools build --all --jobs 8 --include-path /opt/NWNScriptCompiler/Scripts path/to/module
+#   python -m nwscript_tools index /opt/NWNScriptCompiler/Scripts/nwscript.nss
+#
+# Settings are read from the package nwscript.sublime-settings file, then from
+# the files given with --settings (sublime-settings files, or sublime-project
+# files containing a settings.nwscript object), then from command line options.
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+rgx_json_comment = re.compile(r'("(?:\\.|[^"\\])*")|//[^\n]*|/\*.*?\*/', re.DOTALL)
+rgx_json_trailing_comma = re.compile(r'("(?:\\.|[^"\\])*")|,(\s*[\]}])')
+
+
+# Load a Sublime Text JSON file, which may contain comments and trailing commas
+def load_sublime_json(file_path: str) -> Any:
+    with open(file_path, "r", encoding="utf-8") as file:
+        data = file.read()
+    data = rgx_json_comment.sub(lambda m: m.group(1) or "", data)
+    data = rgx_json_trailing_comma.sub(lambda m: m.group(1) or m.group(2), data)
+    return json.loads(data)
+
+
+def load_settings(settings_files: list) -> dict:
+    settings = load_sublime_json(os.path.join(PACKAGE_DIR, "nwscript.sublime-settings"))
+    for file_path in settings_files:
+        data = load_sublime_json(file_path)
+        if file_path.endswith(".sublime-project"):
+            data = data.get("settings", {}).get("nwscript", {})
+        settings.update(data)
+    return settings
+
+
+def default_cache_dir() -> str:
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "STNeverwinterScript")
+
+
+# Load get_doc_fix from the package nwscript_doc_fixes.py file
+def load_get_doc_fix():
+    spec = importlib.util.spec_from_file_location(
+        "nwscript_doc_fixes", os.path.join(PACKAGE_DIR, "nwscript_doc_fixes.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.get_doc_fix
+
+
+def build_index(script_file: str, output_file: str) -> int:
+    with open(script_file, "rb") as file:
+        data = file.read()
+    resref = os.path.splitext(os.path.basename(script_file))[0]
+    with open(os.path.join(PACKAGE_DIR, "nwscript_doc_fixes.py"), "r", encoding="utf-8") as file:
+        doc_fixes_sha1 = get_doc_fixes_hash(file.read())
+    index = SymbolIndex.build(data, resref, load_get_doc_fix(), doc_fixes_sha1)
+    if output_file is None:
+        output_file = os.path.join(PACKAGE_DIR, resref + "_index.json")
+    index.save(output_file)
+    print("Wrote %d declarations to %s" % (len(index.declarations), output_file))
+    return 0
+
+
+def print_build_results(text: str) -> None:
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m nwscript_tools",
+        description="NWScript smart build tools",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    build_parser = subparsers.add_parser("build", help="Compile scripts in a module directory")
+    build_type = build_parser.add_mutually_exclusive_group()
+    build_type.add_argument(
+        "--smart", dest="build_type", action="store_const", const="smart",
+        help="Only compile scripts affected by changes (default)",
+    )
+    build_type.add_argument(
+        "--all", dest="build_type", action="store_const", const="all",
+        help="Compile all scripts",
+    )
+    build_type.add_argument(
+        "--single", metavar="FILE",
+        help="Compile a single script",
+    )
+
+    report_parser = subparsers.add_parser("timings", help="Show the slowest scripts and includes to compile")
+
+    index_parser = subparsers.add_parser(
+        "index",
+        help="Precompile the completion symbol index of a script (usually nwscript.nss)",
+    )
+    index_parser.add_argument("script_file", help="Script to index")
+    index_parser.add_argument(
+        "--output", "-o", metavar="FILE",
+        help="Where to write the index (default: <script name>_index.json in the package directory)",
+    )
+
+    for sub in (build_parser, report_parser):
+        sub.add_argument(
+            "module_dir", nargs="?", default=".",
+            help="Directory containing the module scripts (default: current directory)",
+        )
+        sub.add_argument(
+            "--settings", metavar="FILE", action="append", default=[],
+            help="sublime-settings or sublime-project file to read settings from. Can be repeated.",
+        )
+        sub.add_argument(
+            "--include-path", metavar="DIR", action="append",
+            help="Overrides the include_path setting. Can be repeated.",
+        )
+        sub.add_argument(
+            "--cache-dir", metavar="DIR", default=default_cache_dir(),
+            help="Where to store the script cache (default: %(default)s)",
+        )
+    build_parser.add_argument(
+        "--jobs", "-j", metavar="N", type=int,
+        help="Overrides the build_jobs setting",
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.command == "index":
+        return build_index(args.script_file, args.output)
+
+    settings = load_settings(args.settings)
+    if args.include_path is not None:
+        settings["include_path"] = args.include_path
+    if getattr(args, "jobs", None) is not None:
+        settings["build_jobs"] = args.jobs
+    # A watcher is only useful between two builds of the same process
+    settings["file_watcher"] = "none"
+
+    builder = build.Builder(settings.get, print_build_results, args.cache_dir)
+    module_dir = os.path.abspath(args.module_dir)
+
+    if args.command == "timings":
+        print_build_results(builder.get_timing_report(module_dir))
+        return 0
+
+    if args.single is not None:
+        return 1 if builder.run_build(module_dir, "single", os.path.abspath(args.single)) != 0 else 0
+    return 1 if builder.run_build(module_dir, args.build_type or "smart") != 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
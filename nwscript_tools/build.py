@@ -0,0 +1,1408 @@
+import subprocess
+import threading
+import collections
+import multiprocessing
+import os
+import time
+import json
+import stat
+import shutil
+import hashlib
+from typing import Any, Callable
+from . import diagnostics, dirscan, metadata, output, watcher, wine
+
+# Smart build engine: keeps track of the scripts in the module and include
+# directories, and compiles only the scripts affected by file changes.
+# This module does not depend on Sublime Text, see nwscript_builder.py for the
+# build command and __main__.py for the command line interface.
+
+class Script:
+    def __init__(self):
+        # File relative paths (mostly for Linux compatibility)
+        self.nss = None
+        self.ncs = None
+
+        # True if the file has no main function
+        self.is_library = False
+
+        # List of script dependencies
+        self.dependencies = None
+
+        # Modification time of NSS and NCS files
+        self.nss_mtime = None
+        self.ncs_mtime = None
+
+        # (mtime, size) of the NSS file when is_library and dependencies
+        # were parsed
+        self.nss_stat = None
+
+        # SHA-1 of the NSS file content
+        self.nss_hash = None
+
+        # SHA-1 of the NSS file content without comments and formatting
+        self.code_hash = None
+
+        # code_hash when the changes to the NSS file were last handled by a
+        # build
+        self.built_code_hash = None
+
+        # Fingerprint of the NSS, included scripts and compiler arguments
+        # when the NCS file was last successfully built
+        self.fingerprint = None
+
+        # Set when there is a missing source file
+        # True if the NCS file is meant to be run by NWNScriptAccelerator nwnx4 plugin
+        self.ncs_is_native = None
+
+    def to_json(self) -> list:
+        return [
+            self.nss, self.ncs, self.is_library, self.dependencies,
+            self.nss_mtime, self.ncs_mtime, self.nss_stat, self.ncs_is_native,
+            self.nss_hash, self.fingerprint, self.code_hash, self.built_code_hash,
+        ]
+
+    @staticmethod
+    def from_json(data: list) -> "Script":
+        script = Script()
+        (
+            script.nss, script.ncs, script.is_library, script.dependencies,
+            script.nss_mtime, script.ncs_mtime, script.nss_stat, script.ncs_is_native,
+            script.nss_hash, script.fingerprint, script.code_hash, script.built_code_hash,
+        ) = data
+        if script.nss_stat is not None:
+            script.nss_stat = tuple(script.nss_stat)
+        return script
+
+class DirCache:
+    # Must be incremented each time the file format or the information
+    # extracted by parse_nss / parse_ncs changes
+    VERSION = 7
+
+    def __init__(self):
+        # script name => Script object
+        self.scripts = {}
+
+        # Reverse dependency index
+        # script name => set() of script names directly including it
+        self.dependents = {}
+
+        # Names of the scripts whose NSS or NCS files changed since the last
+        # build
+        self.dirty = set()
+
+        # Names of the scripts that failed to compile during the last build
+        # compiling them. They are rebuilt even if their NCS is up to date.
+        self.failed = set()
+
+        # True when scripts differ from the on-disk cache
+        self.modified = False
+
+    # Set the dependency list of a script and update the reverse dependency index
+    def set_dependencies(self, script_name: str, dependencies: list) -> None:
+        script = self.scripts[script_name]
+        if script.dependencies is not None:
+            for dep in script.dependencies:
+                dependents = self.dependents.get(dep)
+                if dependents is not None:
+                    dependents.discard(script_name)
+                    if len(dependents) == 0:
+                        del self.dependents[dep]
+
+        script.dependencies = dependencies
+        if dependencies is not None:
+            for dep in dependencies:
+                self.dependents.setdefault(dep, set()).add(script_name)
+        self.modified = True
+
+    def remove_script(self, script_name: str) -> None:
+        self.set_dependencies(script_name, None)
+        del self.scripts[script_name]
+
+    # Load the cache saved for a given directory. Returns an empty DirCache if
+    # there is no usable cache file
+    @staticmethod
+    def load(cache_file: str, directory: str) -> "DirCache":
+        dircache = DirCache()
+        try:
+            with open(cache_file, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") != DirCache.VERSION or data.get("directory") != directory:
+                return dircache
+            dircache.scripts = {
+                script_name: Script.from_json(script_data)
+                for script_name, script_data in data["scripts"].items()
+            }
+            dircache.dirty = set(data["dirty"])
+            dircache.failed = set(data["failed"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print("nwscript-smartbuild: ignoring invalid cache file %s: %s" % (cache_file, e))
+            return DirCache()
+
+        for script_name, script in dircache.scripts.items():
+            for dep in script.dependencies or []:
+                dircache.dependents.setdefault(dep, set()).add(script_name)
+        return dircache
+
+    # Write the cache to disk, if it has been modified since last load / save
+    def save(self, cache_file: str, directory: str) -> None:
+        if not self.modified:
+            return
+        write_json_file(cache_file, {
+            "version": DirCache.VERSION,
+            "directory": directory,
+            "scripts": {
+                script_name: script.to_json()
+                for script_name, script in self.scripts.items()
+            },
+            "dirty": sorted(self.dirty),
+            "failed": sorted(self.failed),
+        })
+        self.modified = False
+
+# Compilation times of the scripts in a directory, saved next to the DirCache
+class BuildTimings:
+    VERSION = 2
+
+    # Weight of the latest measure in the recorded compile time of a script
+    SMOOTHING = 0.5
+
+    def __init__(self):
+        # script name => [compile time in seconds, number of included scripts]
+        self.scripts = {}
+
+        # Batches of the last build: [number of scripts, duration in seconds,
+        # number of scripts timed from the compiler output]
+        self.batches = []
+
+        self.modified = False
+        self.lock = threading.Lock()
+
+    def get_time(self, script_name: str) -> float:
+        entry = self.scripts.get(script_name)
+        return entry[0] if entry is not None else None
+
+    def set_include_count(self, script_name: str, include_count: int) -> None:
+        with self.lock:
+            entry = self.scripts.setdefault(script_name, [None, None])
+            if entry[1] != include_count:
+                entry[1] = include_count
+                self.modified = True
+
+    #   script_times: script name => compile time
+    #   is_measured: False if script_times are estimated from the batch duration
+    def record_batch(self, script_count: int, script_times: dict, duration: float, is_measured: bool) -> None:
+        with self.lock:
+            self.batches.append([script_count, duration, len(script_times) if is_measured else 0])
+            for script_name, script_time in script_times.items():
+                entry = self.scripts.setdefault(script_name, [None, None])
+                if entry[0] is None:
+                    entry[0] = script_time
+                else:
+                    entry[0] += self.SMOOTHING * (script_time - entry[0])
+            self.modified = True
+
+    @staticmethod
+    def load(timings_file: str, directory: str) -> "BuildTimings":
+        timings = BuildTimings()
+        try:
+            with open(timings_file, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") == BuildTimings.VERSION and data.get("directory") == directory:
+                timings.scripts = data["scripts"]
+                timings.batches = data["batches"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print("nwscript-smartbuild: ignoring invalid timings file %s: %s" % (timings_file, e))
+            return BuildTimings()
+        return timings
+
+    def save(self, timings_file: str, directory: str) -> None:
+        with self.lock:
+            if not self.modified:
+                return
+            write_json_file(timings_file, {
+                "version": BuildTimings.VERSION,
+                "directory": directory,
+                "scripts": self.scripts,
+                "batches": self.batches,
+            })
+            self.modified = False
+
+# Directory containing compiled scripts, identified by the fingerprint of
+# their sources and the compiler executable. It can be shared between
+# computers, for example on a network drive.
+class ArtifactCache:
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def get_key(fingerprint: str, compiler_hash: str) -> str:
+        return hashlib.sha1((fingerprint + compiler_hash).encode("utf-8")).hexdigest()
+
+    def get_artifact_file(self, key: str, ext: str) -> str:
+        return os.path.join(self.path, key[:2], key + ext)
+
+    # Copy the compiled files from the cache. Returns False if they are not
+    # in the cache.
+    def fetch(self, key: str, ncs_file: str, ndb_file: str) -> bool:
+        cached_ncs = self.get_artifact_file(key, ".ncs")
+        cached_ndb = self.get_artifact_file(key, ".ndb")
+        try:
+            copy_file(cached_ncs, ncs_file)
+        except OSError:
+            return False
+        try:
+            copy_file(cached_ndb, ndb_file)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+
+    def store(self, key: str, ncs_file: str, ndb_file: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.get_artifact_file(key, ".ncs")), exist_ok=True)
+            if os.path.isfile(ndb_file):
+                copy_file(ndb_file, self.get_artifact_file(key, ".ndb"))
+            copy_file(ncs_file, self.get_artifact_file(key, ".ncs"))
+        except OSError as e:
+            print("nwscript-smartbuild: could not store %s in artifact cache: %s" % (ncs_file, e))
+
+# Copy a file content, using a temp file first so other processes never see
+# it half-written. The destination file modification time is the current time.
+def copy_file(src: str, dst: str) -> None:
+    tmp_file = "%s.%d.tmp" % (dst, os.getpid())
+    try:
+        shutil.copyfile(src, tmp_file)
+        os.replace(tmp_file, dst)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+# Write a JSON file, using a temp file first so it can't be left half-written
+def write_json_file(file_path: str, data) -> None:
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    tmp_file = file_path + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8") as file:
+        json.dump(data, file)
+    os.replace(tmp_file, file_path)
+
+
+class Builder:
+    # Seconds to wait for the end of the compiler output after the compiler
+    # process exited
+    STREAM_END_TIMEOUT = 0.5
+
+    #   get_settings_value: function returning a setting value (see nwscript.sublime-settings)
+    #   print_build_results: function writing build output text, may be called from any thread
+    #   cache_dir: where to store the script cache, or None to disable the on-disk cache
+    def __init__(
+        self,
+        get_settings_value: Callable[[str], Any],
+        print_build_results: Callable[[str], None],
+        cache_dir: str = None,
+    ):
+        self.get_settings_value = get_settings_value
+        self.print_build_results = print_build_results
+        self.cache_dir = cache_dir
+
+        self.started_processes = []
+        # output.OutputAggregator of the running build
+        self.output = None
+        self.build_lock = threading.Lock()
+        self.stop_build = False
+
+        # directory => DirCache
+        self.cache = {}
+        self.cached_include_paths = None
+
+        # directory => (backend name, nwscript_tools.watcher.DirWatcher)
+        self.watchers = {}
+
+        # directory => BuildTimings
+        self.timings = {}
+
+        # (file path, mtime, size) => SHA-1 of compiler executable files
+        self.compiler_hashes = {}
+
+        # directory => {script name => list of diagnostics.Diagnostic}
+        # Diagnostics reported by the compiler for each script, the last time
+        # a script containing or including it was compiled
+        self.diagnostics = {}
+
+    # Main build function
+    #   build_type: "smart", "all", "single" or "kill"
+    #   file: script to compile for "single" builds
+    #   on_start: function called once the previous build has been stopped
+    # Returns 0 if there was no error, otherwise != 0
+    def run_build(self, working_dir: str, build_type: str, file: str = None, on_start=None) -> int:
+        # Stop currently running processes
+        if self.build_lock.locked():
+            self.print_build_results("STOPPING CURRENT BUILD\n")
+            self.stop_build = True
+            for p in self.started_processes:
+                p.terminate()
+            self.build_lock.acquire()
+            self.build_lock.release()
+            self.stop_build = False
+            self.print_build_results("STOPPED\n")
+
+        if build_type == "kill":
+            return 0
+
+        with self.build_lock:
+            if on_start is not None:
+                on_start()
+
+            # Get Wine ready while scripts are being parsed
+            wine_keepalive = self.get_settings_value("wine_keepalive") or 0
+            if wine_keepalive > 0:
+                wine.start_wineserver(self.get_settings_value("compiler_cmd"), wine_keepalive)
+
+            fingerprints = None
+            artifact_cache = None
+            if build_type == "single":
+                src_to_build = [file]
+                src_costs = None
+                scripts_to_build = [os.path.splitext(os.path.basename(file))[0].lower()]
+            else:
+                # Parse scripts in include paths (will be done only the first time)
+                self.init_includes_cache()
+
+                # Update module script list
+                self.update_script_list(working_dir)
+
+                # Cache is now built
+                dircache = self.cache[working_dir]
+
+                # Scripts changed since last successful build
+                changed_scripts = dircache.dirty.copy()
+
+                # Get modified script + scripts using them
+                if build_type == "all":
+                    scripts_to_build = [sn for sn in dircache.scripts if dircache.scripts[sn].nss is not None]
+                elif build_type == "smart":
+                    scripts_to_build = self.get_unbuilt_scripts(working_dir, changed_scripts)
+                else:
+                    self.print_build_results("Unknown build type: '%s'\n" % build_type)
+                    return 1
+
+                if len(scripts_to_build) == 0:
+                    self.mark_scripts_built(working_dir, changed_scripts)
+                    self.print_build_results("=> No scripts needs to be compiled\n")
+                    return 0
+
+                self.print_build_results("=> %d scripts will be compiled\n" % len(scripts_to_build))
+
+                # Source files to compile
+                src_to_build = [dircache.scripts[sn].nss for sn in scripts_to_build]
+                src_costs = self.estimate_build_costs(working_dir, scripts_to_build)
+
+                artifact_cache = self.get_artifact_cache()
+                if self.get_settings_value("rebuild_detection") == "hash" or artifact_cache is not None:
+                    fingerprints = self.get_script_fingerprints(working_dir, scripts_to_build)
+                    ncs_mtimes = {
+                        sn: dircache.scripts[sn].ncs_mtime if dircache.scripts[sn].ncs is not None else None
+                        for sn in scripts_to_build
+                    }
+                else:
+                    # Recorded fingerprints won't match the new NCS files
+                    for sn in scripts_to_build:
+                        dircache.scripts[sn].fingerprint = None
+
+                if artifact_cache is not None:
+                    # Copy already compiled scripts from the artifact cache
+                    compiler_hash = self.get_compiler_hash()
+                    artifact_keys = {
+                        sn: artifact_cache.get_key(fingerprints[sn], compiler_hash)
+                        for sn in scripts_to_build
+                    }
+                    fetched_scripts = set(
+                        sn for sn in scripts_to_build
+                        if not dircache.scripts[sn].is_library and artifact_cache.fetch(
+                            artifact_keys[sn],
+                            self.get_output_file(working_dir, sn, ".ncs"),
+                            self.get_output_file(working_dir, sn, ".ndb"),
+                        )
+                    )
+                    src_to_build = [
+                        dircache.scripts[sn].nss for sn in scripts_to_build
+                        if sn not in fetched_scripts
+                    ]
+
+            self.print_build_results(" Starting compilation ".center(80, "=") + "\n")
+
+            # Build the scripts
+            perf_build_start = time.time()
+
+            status = 0
+            build_diagnostics = []
+            failed_batches = []
+            if len(src_to_build) > 0:
+                status = self.compile_files(
+                    working_dir, src_to_build, src_costs, build_diagnostics, failed_batches
+                )
+
+            perf_build_end = time.time()
+            perf_build_duration = perf_build_end - perf_build_start
+
+            if fingerprints is not None:
+                built_scripts = self.record_built_fingerprints(working_dir, fingerprints, ncs_mtimes)
+
+                if artifact_cache is not None:
+                    # Share newly compiled scripts
+                    for sn in built_scripts - fetched_scripts:
+                        artifact_cache.store(
+                            artifact_keys[sn],
+                            self.get_output_file(working_dir, sn, ".ncs"),
+                            self.get_output_file(working_dir, sn, ".ndb"),
+                        )
+            failed_scripts = self.record_diagnostics(
+                working_dir, set(scripts_to_build), build_diagnostics, failed_batches
+            )
+            if build_type != "single" and not self.stop_build:
+                # Scripts that failed are rebuilt by the next build, so
+                # changes can be forgotten even if there were errors
+                dircache.failed = (dircache.failed - set(scripts_to_build)) | failed_scripts
+                self.mark_scripts_built(working_dir, changed_scripts)
+
+            # Statz
+            time.sleep(0.1)
+            self.print_build_results(" Compilation ended ".center(80, "=") + "\n")
+            if status == 0:
+                self.print_build_results(
+                    "Finished %s build in %.1f seconds\n" % (build_type, perf_build_duration)
+                )
+            else:
+                self.print_build_results(
+                    "Finished %s build in %.1f seconds with some errors\n" % (build_type, perf_build_duration)
+                )
+            if artifact_cache is not None:
+                self.print_build_results(
+                    "Artifact cache: %d hits, %d misses\n" % (len(fetched_scripts), len(src_to_build))
+                )
+
+            return status
+
+    # Return a text report listing the slowest scripts and includes to compile
+    def get_timing_report(self, working_dir: str) -> str:
+        for folder in [working_dir] + self.get_settings_value("include_path"):
+            if folder not in self.cache:
+                self.cache[folder] = self.load_dircache(folder)
+        dircache = self.cache[working_dir]
+        timings = self.get_timings(working_dir)
+
+        # Scripts compile times
+        script_times = [
+            (entry[0], entry[1], script_name)
+            for script_name, entry in timings.scripts.items()
+            if entry[0] is not None and script_name in dircache.scripts
+        ]
+        script_times.sort(reverse=True)
+
+        # Compile time of all scripts using each include
+        include_trees = {}
+        include_times = {}
+        for script_time, _, script_name in script_times:
+            for include in self.get_include_tree(working_dir, script_name, include_trees):
+                entry = include_times.setdefault(include, [0.0, 0])
+                entry[0] += script_time
+                entry[1] += 1
+        include_times = sorted(
+            [(entry[0], entry[1], include) for include, entry in include_times.items()],
+            reverse=True
+        )
+
+        text = "Build timings for %s\n\n" % working_dir
+        if len(timings.batches) > 0:
+            text += "Last build: %d batches, %.1f seconds of compiler time, longest batch %.1f seconds\n" % (
+                len(timings.batches),
+                sum(b[1] for b in timings.batches),
+                max(b[1] for b in timings.batches),
+            )
+            text += "%d of %d scripts timed from the compiler output, others estimated from their batch duration\n\n" % (
+                sum(b[2] for b in timings.batches),
+                sum(b[0] for b in timings.batches),
+            )
+
+        text += "Slowest scripts:\n"
+        text += "%10s %10s  %s\n" % ("Time (s)", "Includes", "Script")
+        for script_time, include_count, script_name in script_times[:50]:
+            text += "%10.2f %10s  %s\n" % (
+                script_time, include_count if include_count is not None else "?", script_name
+            )
+
+        text += "\nSlowest includes (total compile time of the scripts using them):\n"
+        text += "%10s %10s  %s\n" % ("Time (s)", "Scripts", "Include")
+        for include_time, script_count, include in include_times[:50]:
+            text += "%10.2f %10d  %s\n" % (include_time, script_count, include)
+
+        return text
+
+    def init_includes_cache(self) -> None:
+        cache = self.get_settings_value("include_path")
+
+        # Check if include list changed
+        if self.cached_include_paths == cache:
+            return
+
+        # Remove previous cache
+        if self.cached_include_paths is not None:
+            for path in self.cached_include_paths:
+                self.cache.pop(path, None)
+
+        # Save include path list
+        self.cached_include_paths = cache.copy()
+
+        # Build simple cache (only parse modified NSS files)
+        for folder in self.cached_include_paths:
+            self.print_build_results("Parsing scripts in include path %s...\n" % folder)
+            dircache = self.cache.get(folder)
+            if dircache is None:
+                dircache = self.load_dircache(folder)
+                self.cache[folder] = dircache
+
+            found_nss = set()
+            for filename, file_stat in dirscan.get_script_dir(folder).scan().items():
+                if os.path.splitext(filename)[1].lower() != ".nss":
+                    continue
+                filepath = os.path.join(folder, filename)
+                script_name = os.path.splitext(filename)[0].lower()
+                found_nss.add(script_name)
+
+                script = dircache.scripts.setdefault(script_name, Script())
+                nss_stat = (file_stat.st_mtime, file_stat.st_size)
+                if script.nss != filepath or script.nss_stat != nss_stat:
+                    script.nss = filepath
+                    script.is_library, dependencies, script.nss_hash, script.code_hash = self.parse_nss(filepath, file_stat)
+                    dircache.set_dependencies(script_name, dependencies)
+                    script.nss_stat = nss_stat
+                    script.nss_mtime = 0.0
+
+            # Remove deleted files from cache
+            for script_name in set(dircache.scripts) - found_nss:
+                dircache.remove_script(script_name)
+
+            self.save_dircache(folder)
+
+
+    # List all scripts in workdir and update information in self.cache[workdir]
+    def update_script_list(self, workdir: str) -> None:
+        dircache = self.cache.get(workdir)
+        if dircache is None:
+            dircache = self.load_dircache(workdir)
+            self.cache[workdir] = dircache
+
+        # Ask the file watcher which files changed since last build
+        changes = None
+        watcher = self.get_watcher(workdir)
+        if watcher is not None:
+            changes = watcher.pop_changes()
+
+        if changes is not None:
+            self.print_build_results("Updating %d changed files in %s...\n" % (len(changes), workdir))
+            for filename in changes:
+                filepath = os.path.join(workdir, filename)
+                try:
+                    file_stat = os.stat(filepath)
+                    if not stat.S_ISREG(file_stat.st_mode):
+                        file_stat = None
+                except OSError:
+                    file_stat = None
+                self.update_script_file(workdir, filename, file_stat)
+        else:
+            self.print_build_results("Parsing scripts in %s...\n" % workdir)
+            found_nss = set()
+            found_ncs = set()
+
+            # Find all scripts in workdir
+            for filename, file_stat in dirscan.get_script_dir(workdir).scan().items():
+                script_name = self.update_script_file(workdir, filename, file_stat)
+                if os.path.splitext(filename)[1].lower() == ".nss":
+                    found_nss.add(script_name)
+                else:
+                    found_ncs.add(script_name)
+
+            # Remove deleted files from cache
+            for script_name, script in list(dircache.scripts.items()):
+                if script_name not in found_nss and script.nss is not None:
+                    self.update_script_file(workdir, script.nss, None)
+                if script_name not in found_ncs and script.ncs is not None:
+                    self.update_script_file(workdir, script.ncs, None)
+
+        # Find scripts with missing source files
+        no_source_scripts = []
+        for script_name, script in dircache.scripts.items():
+            if script.nss is None:
+                if script.ncs_is_native is None:
+                    # Parse NCS file to know if it should have an associated NSS file
+                    script.ncs_is_native = self.parse_ncs(os.path.join(workdir, script.ncs))
+                    dircache.modified = True
+
+                if script.ncs_is_native is False:
+                    no_source_scripts.append(script_name)
+
+        if len(no_source_scripts) > 0:
+            self.print_build_results(
+                "Warning: The following scripts have missing source files: %s\n"
+                % self.script_list_to_str(no_source_scripts)
+            )
+
+        self.save_dircache(workdir)
+
+    # Update cached information about a single NSS or NCS file in workdir
+    #   file_stat: os.stat result of the file, or None if it has been deleted
+    # Returns the script name, or None if the file is not a script
+    def update_script_file(self, workdir: str, filename: str, file_stat: os.stat_result) -> str:
+        script_name, ext = os.path.splitext(filename)
+        script_name = script_name.lower()
+        ext = ext.lower()
+        if ext not in [".nss", ".ncs"]:
+            return None
+
+        dircache = self.cache[workdir]
+        script = dircache.scripts.get(script_name)
+
+        if file_stat is None:
+            # File has been removed
+            if script is None:
+                return script_name
+            if ext == ".nss" and script.nss == filename:
+                script.nss = None
+                script.nss_stat = None
+                dircache.dirty.add(script_name)
+                dircache.modified = True
+            elif ext == ".ncs" and script.ncs == filename:
+                script.ncs = None
+                script.ncs_is_native = None
+                dircache.dirty.add(script_name)
+                dircache.modified = True
+            if script.nss is None and script.ncs is None:
+                dircache.remove_script(script_name)
+            return script_name
+
+        if script is None:
+            script = dircache.scripts.setdefault(script_name, Script())
+        mtime = file_stat.st_mtime
+
+        if ext == ".nss":
+            nss_stat = (mtime, file_stat.st_size)
+            if script.nss is None or script.nss_stat != nss_stat:
+                # Script is unknown or has been modified, parse it
+                script.is_library, dependencies, script.nss_hash, script.code_hash = self.parse_nss(
+                    os.path.join(workdir, filename), file_stat
+                )
+                dircache.set_dependencies(script_name, dependencies)
+                script.nss_stat = nss_stat
+            if script.nss != filename or script.nss_mtime != mtime:
+                script.nss = filename
+                script.nss_mtime = mtime
+                dircache.dirty.add(script_name)
+                dircache.modified = True
+        else:
+            if script.ncs != filename or script.ncs_mtime != mtime:
+                script.ncs = filename
+                script.ncs_mtime = mtime
+                script.ncs_is_native = None
+                dircache.dirty.add(script_name)
+                dircache.modified = True
+        return script_name
+
+    # Return the file watcher for a directory, or None if disabled
+    def get_watcher(self, directory: str) -> watcher.DirWatcher:
+        backend = self.get_settings_value("file_watcher") or "none"
+        watcher_backend, dir_watcher = self.watchers.get(directory, (None, None))
+        if dir_watcher is not None and (watcher_backend != backend or dir_watcher.is_broken()):
+            dir_watcher.close()
+            dir_watcher = None
+            del self.watchers[directory]
+
+        if dir_watcher is None and backend != "none":
+            dir_watcher = watcher.create_watcher(directory, backend)
+            self.watchers[directory] = (backend, dir_watcher)
+        return dir_watcher
+
+    # Forget changes that have been handled by a build
+    def mark_scripts_built(self, workdir: str, changed_scripts: set) -> None:
+        dircache = self.cache[workdir]
+        dircache.dirty -= changed_scripts
+        for script_name in changed_scripts:
+            script = dircache.scripts.get(script_name)
+            if script is not None:
+                script.built_code_hash = script.code_hash
+        dircache.modified = True
+        self.save_dircache(workdir)
+
+    # Path of the on-disk cache file for a given directory
+    #   kind: "" for the DirCache, or a suffix for other cached information
+    def get_cache_file(self, directory: str, kind: str = "") -> str:
+        key = os.path.normcase(os.path.abspath(directory)).encode("utf-8")
+        return os.path.join(
+            self.cache_dir,
+            hashlib.sha1(key).hexdigest() + ("." + kind if kind != "" else "") + ".json"
+        )
+
+    def load_dircache(self, directory: str) -> DirCache:
+        if self.cache_dir is None:
+            return DirCache()
+        return DirCache.load(self.get_cache_file(directory), directory)
+
+    def save_dircache(self, directory: str) -> None:
+        if self.cache_dir is None:
+            return
+        try:
+            self.cache[directory].save(self.get_cache_file(directory), directory)
+        except OSError as e:
+            self.print_build_results("Warning: could not save script cache: %s\n" % e)
+
+    def get_timings(self, directory: str) -> BuildTimings:
+        timings = self.timings.get(directory)
+        if timings is None:
+            if self.cache_dir is None:
+                timings = BuildTimings()
+            else:
+                timings = BuildTimings.load(self.get_cache_file(directory, "timings"), directory)
+            self.timings[directory] = timings
+        return timings
+
+    def save_timings(self, directory: str) -> None:
+        if self.cache_dir is None or directory not in self.timings:
+            return
+        try:
+            self.timings[directory].save(self.get_cache_file(directory, "timings"), directory)
+        except OSError as e:
+            self.print_build_results("Warning: could not save build timings: %s\n" % e)
+
+
+    # Extract all scripts in self.cache[workdir] that needs to be built. Only
+    # the scripts that changed since the last build, the scripts depending on
+    # them, and the scripts that failed to compile, are checked.
+    #
+    # With the early_cutoff setting, scripts including a changed script are
+    # not checked if only the comments or formatting of the changed script
+    # have changed since the last build.
+    #
+    # With the "mtime" rebuild_detection setting, a script is rebuilt if its
+    # NSS or one of its included scripts is newer than its NCS.
+    # With "hash", a script is rebuilt if the fingerprint of its NSS content,
+    # included scripts content and compiler arguments is different from the
+    # one recorded on its last successful build.
+    def get_unbuilt_scripts(self, workdir: str, changed_scripts: set) -> set:
+        dircache = self.cache[workdir]
+        use_hash = self.get_settings_value("rebuild_detection") == "hash"
+        early_cutoff = self.get_settings_value("early_cutoff") is True
+
+        # Scripts included by module scripts, but not found anywhere
+        missing_scripts = set()
+        for folder in [workdir] + self.get_settings_value("include_path"):
+            for dep, dependents in self.cache[folder].dependents.items():
+                if dep in missing_scripts or self.find_script_by_name(workdir, dep) is not None:
+                    continue
+                if dircache.scripts.keys().isdisjoint(self.get_dependent_scripts(workdir, dep)):
+                    continue
+                missing_scripts.add(dep)
+                self.print_build_results(
+                    "Warning: could not find script '%s', included in '%s'\n"
+                    % (dep, self.script_list_to_str(sorted(dependents)))
+                )
+
+        # script name => latest NSS mtime of the changed scripts it includes
+        dependency_mtimes = {}
+        # Changed scripts whose code did not change, and scripts including them
+        cutoff_scripts = set()
+        cutoff_dependents = set()
+        for changed_name in changed_scripts | missing_scripts:
+            changed_script = self.find_script_by_name(workdir, changed_name)
+            if changed_script is None:
+                # Script is not found. Assume the dependency is changed to
+                # force build error
+                changed_mtime = float("inf")
+            elif changed_script.nss is None:
+                # Only the NCS file changed
+                continue
+            elif (
+                early_cutoff and changed_script.code_hash is not None
+                and changed_script.code_hash == changed_script.built_code_hash
+            ):
+                # Only comments or formatting changed
+                dependents = self.get_dependent_scripts(workdir, changed_name)
+                if len(dependents) > 0:
+                    cutoff_scripts.add(changed_name)
+                    cutoff_dependents |= dependents
+                continue
+            else:
+                changed_mtime = changed_script.nss_mtime
+
+            for script_name in self.get_dependent_scripts(workdir, changed_name):
+                if changed_mtime > dependency_mtimes.get(script_name, 0.0):
+                    dependency_mtimes[script_name] = changed_mtime
+
+        include_trees = {}
+        if use_hash:
+            self.seed_script_fingerprints(workdir, include_trees)
+
+        # Algorithm:
+        # - Go through changed scripts and scripts including them
+        #   - if it's not a library, ie has a main function:
+        #     - if there is no NCS => build it
+        #     - if nss mtime > ncs mtime => build it
+        #     - if the mtime of a changed dependency > ncs mtime => build it
+        #     - in hash mode, the two previous checks are replaced by a
+        #       fingerprint comparison
+        #     - if it failed to compile last time => build it
+        #
+        scripts_to_build = [set(), set(), set(), set()]
+        for script_name in changed_scripts | dependency_mtimes.keys() | dircache.failed:
+            script = dircache.scripts.get(script_name)
+            if script is None or script.nss is None or script.is_library:
+                if script_name in dircache.failed:
+                    dircache.failed.discard(script_name)
+                    dircache.modified = True
+                continue
+
+            # Script has source code and a main function
+            if script.ncs is None:
+                # Script has never been built
+                scripts_to_build[0].add(script_name)
+                continue
+
+            if script_name in dircache.failed:
+                # The NCS may be left from an older build
+                scripts_to_build[3].add(script_name)
+                continue
+
+            is_outdated = script.nss_mtime > script.ncs_mtime
+            is_dep_outdated = dependency_mtimes.get(script_name, 0.0) > script.ncs_mtime
+
+            if use_hash and dependency_mtimes.get(script_name) != float("inf"):
+                fingerprint = self.get_script_fingerprint(workdir, script_name, include_trees)
+                if script.fingerprint is None:
+                    # Fingerprint unknown, rely on modification times
+                    if not is_outdated and not is_dep_outdated:
+                        script.fingerprint = fingerprint
+                        dircache.modified = True
+                        continue
+                elif script.fingerprint == fingerprint:
+                    continue
+
+                if script_name in changed_scripts:
+                    scripts_to_build[1].add(script_name)
+                else:
+                    scripts_to_build[2].add(script_name)
+
+            elif is_outdated:
+                # Script has been modified
+                scripts_to_build[1].add(script_name)
+            elif is_dep_outdated:
+                # One of its dependencies have been modified
+                scripts_to_build[2].add(script_name)
+
+        all_scripts_to_build = scripts_to_build[0] | scripts_to_build[1] | scripts_to_build[2] | scripts_to_build[3]
+
+        if len(cutoff_scripts) > 0:
+            skipped_scripts = set(
+                script_name for script_name in cutoff_dependents - all_scripts_to_build
+                if script_name in dircache.scripts and not dircache.scripts[script_name].is_library
+            )
+            self.print_build_results(
+                "Early cutoff: %d scripts not rebuilt, code unchanged in: %s\n"
+                % (len(skipped_scripts), self.script_list_to_str(sorted(cutoff_scripts)))
+            )
+
+        self.print_build_results(
+            "%d scripts with missing NCS: %s\n"
+            % (len(scripts_to_build[0]), self.script_list_to_str(scripts_to_build[0]))
+            + "%d scripts with outdated NCS: %s\n"
+            % (len(scripts_to_build[1]), self.script_list_to_str(scripts_to_build[1]))
+            + "%d scripts impacted by a dependency change: %s\n"
+            % (len(scripts_to_build[2]), self.script_list_to_str(scripts_to_build[2]))
+            + "%d scripts that failed to compile: %s\n"
+            % (len(scripts_to_build[3]), self.script_list_to_str(scripts_to_build[3]))
+        )
+
+        return all_scripts_to_build
+
+    # Fingerprint of everything that affects the compiled output of a script:
+    # its NSS content, the content of all scripts it includes (ignoring their
+    # comments and formatting with the early_cutoff setting), and the
+    # compiler arguments
+    #   include_trees: see get_include_tree
+    def get_script_fingerprint(self, workdir: str, script_name: str, include_trees: dict) -> str:
+        script = self.cache[workdir].scripts[script_name]
+        early_cutoff = self.get_settings_value("early_cutoff") is True
+
+        # Paths are not part of the fingerprint, so it can be shared between
+        # computers. The content of the included scripts is enough.
+        fingerprint = hashlib.sha1()
+        fingerprint.update(json.dumps(self.get_settings_value("compiler_args")).encode("utf-8"))
+        # The NDB file contains the script name
+        fingerprint.update(("%s:%s" % (script_name, script.nss_hash)).encode("utf-8"))
+
+        for dep in sorted(self.get_include_tree(workdir, script_name, include_trees)):
+            dep_script = self.find_script_by_name(workdir, dep)
+            if dep_script is None or dep_script.nss is None:
+                dep_hash = "missing"
+            elif early_cutoff and dep_script.code_hash is not None:
+                dep_hash = dep_script.code_hash
+            else:
+                dep_hash = dep_script.nss_hash
+            fingerprint.update(("\0%s:%s" % (dep, dep_hash)).encode("utf-8"))
+
+        return fingerprint.hexdigest()
+
+    # Record the fingerprint of the scripts that have none yet, usually because
+    # they were built before switching to the "hash" rebuild_detection, if
+    # their NCS is newer than their NSS and the scripts they include.
+    # Otherwise unchanged scripts would be rebuilt on their next modification
+    # time change.
+    #   include_trees: see get_include_tree
+    def seed_script_fingerprints(self, workdir: str, include_trees: dict) -> None:
+        dircache = self.cache[workdir]
+
+        seeded_count = 0
+        for script_name, script in dircache.scripts.items():
+            if (
+                script.fingerprint is not None or script.nss is None or script.ncs is None
+                or script.is_library or script_name in dircache.failed
+                or script.nss_mtime > script.ncs_mtime
+            ):
+                continue
+
+            is_up_to_date = True
+            for dep in self.get_include_tree(workdir, script_name, include_trees):
+                dep_script = self.find_script_by_name(workdir, dep)
+                if dep_script is None or dep_script.nss is None or dep_script.nss_mtime > script.ncs_mtime:
+                    is_up_to_date = False
+                    break
+            if not is_up_to_date:
+                continue
+
+            script.fingerprint = self.get_script_fingerprint(workdir, script_name, include_trees)
+            dircache.modified = True
+            seeded_count += 1
+
+        if seeded_count > 0:
+            self.print_build_results("Recorded the fingerprint of %d up-to-date scripts\n" % seeded_count)
+
+    # Returns a script name => fingerprint dict
+    def get_script_fingerprints(self, workdir: str, script_names) -> dict:
+        include_trees = {}
+        return {
+            script_name: self.get_script_fingerprint(workdir, script_name, include_trees)
+            for script_name in script_names
+        }
+
+    # Record the fingerprints of the scripts that have been successfully built
+    #   ncs_mtimes: script name => NCS mtime before the build (None if no NCS)
+    # Returns the set of successfully built scripts
+    def record_built_fingerprints(self, workdir: str, fingerprints: dict, ncs_mtimes: dict) -> set:
+        dircache = self.cache[workdir]
+
+        built_ncs = {}
+        for filename, file_stat in dirscan.get_script_dir(workdir).scan().items():
+            script_name, ext = os.path.splitext(filename)
+            if ext.lower() == ".ncs":
+                built_ncs[script_name.lower()] = file_stat.st_mtime
+
+        built_scripts = set()
+        for script_name, fingerprint in fingerprints.items():
+            ncs_mtime = built_ncs.get(script_name)
+            script = dircache.scripts.get(script_name)
+            if script is not None and ncs_mtime is not None and ncs_mtime != ncs_mtimes.get(script_name):
+                script.fingerprint = fingerprint
+                dircache.modified = True
+                built_scripts.add(script_name)
+        self.save_dircache(workdir)
+        return built_scripts
+
+    # Store the diagnostics reported by the compiler during a build. They
+    # replace the previous diagnostics of the compiled scripts and of the
+    # scripts they include.
+    #   built_scripts: names of the compiled scripts
+    #   build_diagnostics: list of diagnostics.Diagnostic, in output order
+    #   failed_batches: lists of NSS files compiled by processes that
+    #       returned an error
+    # Returns the names of the compiled scripts that failed
+    def record_diagnostics(self, workdir: str, built_scripts: set, build_diagnostics: list, failed_batches: list) -> set:
+        script_diagnostics = self.diagnostics.setdefault(workdir, {})
+
+        # Include trees are only known if the scripts have been parsed, which
+        # is not the case for single builds
+        include_trees = {}
+        has_cache = all(folder in self.cache for folder in [workdir] + self.get_settings_value("include_path"))
+
+        def get_include_tree(script_name):
+            if not has_cache:
+                return set()
+            return self.get_include_tree(workdir, script_name, include_trees)
+
+        for script_name in built_scripts:
+            script_diagnostics.pop(script_name, None)
+            for include in get_include_tree(script_name):
+                script_diagnostics.pop(include, None)
+
+        # Diagnostics of an included script are reported once for each
+        # compiled script including it
+        new_diagnostics = {}
+        seen = set()
+        error_scripts = set()
+        for diag in build_diagnostics:
+            script_name = diag.get_script_name()
+            key = (script_name, diag.line, diag.severity, diag.code, diag.message)
+            if key in seen:
+                continue
+            seen.add(key)
+            new_diagnostics.setdefault(script_name, []).append(diag)
+            if diag.severity == "Error":
+                error_scripts.add(script_name)
+        script_diagnostics.update(new_diagnostics)
+
+        # Scripts with errors in their file or include tree failed. If the
+        # errors of a failed process can't be attributed (e.g. the compiler
+        # crashed), consider its whole batch failed.
+        failed = set()
+        for batch in failed_batches:
+            batch_scripts = set(os.path.splitext(os.path.basename(nss))[0].lower() for nss in batch)
+            batch_failed = set(
+                script_name for script_name in batch_scripts
+                if script_name in error_scripts or not error_scripts.isdisjoint(get_include_tree(script_name))
+            )
+            failed |= batch_failed if len(batch_failed) > 0 else batch_scripts
+        return failed
+
+    # Return the diagnostics of the last builds in workdir
+    # Returns a dict of absolute NSS file path => list of diagnostics.Diagnostic
+    def get_diagnostic_files(self, workdir: str) -> dict:
+        has_cache = all(folder in self.cache for folder in [workdir] + self.get_settings_value("include_path"))
+        ret = {}
+        for script_name, script_diagnostics in self.diagnostics.get(workdir, {}).items():
+            script = self.find_script_by_name(workdir, script_name) if has_cache else None
+            if script is not None and script.nss is not None:
+                file_path = os.path.join(workdir, script.nss)
+            else:
+                file_path = os.path.join(workdir, script_diagnostics[0].file)
+            ret[os.path.abspath(file_path)] = script_diagnostics
+        return ret
+
+    # Path of a compiled file (NCS, NDB) for a script in workdir
+    def get_output_file(self, workdir: str, script_name: str, ext: str) -> str:
+        script = self.cache[workdir].scripts[script_name]
+        if ext == ".ncs" and script.ncs is not None:
+            return os.path.join(workdir, script.ncs)
+        return os.path.join(workdir, os.path.splitext(script.nss)[0] + ext)
+
+    def get_artifact_cache(self) -> "ArtifactCache":
+        path = self.get_settings_value("artifact_cache_path")
+        if path is None or path == "":
+            return None
+        return ArtifactCache(path)
+
+    # Hash of the compiler executable files in the compiler_cmd setting
+    def get_compiler_hash(self) -> str:
+        ret = hashlib.sha1()
+        for arg in self.get_settings_value("compiler_cmd"):
+            try:
+                file_stat = os.stat(arg)
+            except OSError:
+                continue
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+
+            key = (arg, file_stat.st_mtime, file_stat.st_size)
+            file_hash = self.compiler_hashes.get(key)
+            if file_hash is None:
+                with open(arg, "rb") as file:
+                    file_hash = hashlib.sha1(file.read()).hexdigest()
+                self.compiler_hashes[key] = file_hash
+            ret.update(file_hash.encode("utf-8"))
+        return ret.hexdigest()
+
+    # Return the names of all scripts including script_name, directly or not
+    def get_dependent_scripts(self, workdir: str, script_name: str) -> set:
+        folders = [workdir] + self.get_settings_value("include_path")
+        ret = set()
+        to_explore = [script_name]
+        while len(to_explore) > 0:
+            curr_script_name = to_explore.pop()
+            for folder in folders:
+                for dependent in self.cache[folder].dependents.get(curr_script_name, ()):
+                    if dependent not in ret:
+                        ret.add(dependent)
+                        to_explore.append(dependent)
+        return ret
+
+    # Search through current dir and include paths to find a given script
+    def find_script_by_name(self, working_dir, script_name) -> Script:
+        for folder in [working_dir] + self.get_settings_value("include_path"):
+            script = self.cache[folder].scripts.get(script_name, None)
+            if script is not None:
+                return script
+        return None
+
+
+    # Parse a NSS file and extract include list, check if there is a main
+    # function, and hash its content. With the early_cutoff setting, its
+    # content is also hashed without comments and formatting, otherwise the
+    # returned code hash is None.
+    # Uses the metadata store shared with the completion engine.
+    def parse_nss(self, filepath: str, file_stat: os.stat_result = None) -> (bool, list, str, str):
+        early_cutoff = self.get_settings_value("early_cutoff") is True
+        script = metadata.get_store().get(filepath, file_stat, with_code_sha1=early_cutoff)
+        return (not script.has_main, [include.lower() for include in script.includes], script.sha1, script.code_sha1)
+
+    # Parse a NCS file and return if it is a native script for the NWNScriptAccelerator nwnx4 plugin
+    @staticmethod
+    def parse_ncs(file_path: str) -> bool:
+        with open(file_path, "rb") as file:
+            header = file.read(0x3f)
+            if len(header) == 0x3f and header[0x1B: 0x3f] == b"NWScript Platform Native Script v1.0":
+                return True
+            return False
+
+    # Return the set of all scripts included by script_name, directly or not
+    #   include_trees: script name => include tree dict, used as a cache
+    def get_include_tree(self, workdir: str, script_name: str, include_trees: dict) -> set:
+        tree = include_trees.get(script_name)
+        if tree is not None:
+            return tree
+
+        tree = set()
+        to_explore = [script_name]
+        while len(to_explore) > 0:
+            script = self.find_script_by_name(workdir, to_explore.pop())
+            if script is None or script.dependencies is None:
+                continue
+            for dep in script.dependencies:
+                if dep not in tree:
+                    tree.add(dep)
+                    to_explore.append(dep)
+        include_trees[script_name] = tree
+        return tree
+
+    # Estimate how long each script takes to compile, using recorded compile
+    # times, or the number of scripts in its include tree for scripts that
+    # have never been compiled.
+    # Returns a NSS file => cost dict
+    def estimate_build_costs(self, workdir: str, script_names) -> dict:
+        dircache = self.cache[workdir]
+        timings = self.get_timings(workdir)
+
+        include_trees = {}
+        include_counts = {}
+        for script_name in script_names:
+            include_counts[script_name] = len(self.get_include_tree(workdir, script_name, include_trees))
+            timings.set_include_count(script_name, include_counts[script_name])
+
+        # Average compile time per script in the include tree
+        total_time = 0.0
+        total_includes = 0
+        for script_time, include_count in timings.scripts.values():
+            if script_time is not None and include_count is not None:
+                total_time += script_time
+                total_includes += 1 + include_count
+        time_per_include = total_time / total_includes if total_includes > 0 else 1.0
+
+        ret = {}
+        for script_name in script_names:
+            script_time = timings.get_time(script_name)
+            if script_time is None:
+                script_time = (1 + include_counts[script_name]) * time_per_include
+            ret[dircache.scripts[script_name].nss] = script_time
+        return ret
+
+    # Compile many files using a fixed number of compiler processes. Each
+    # process compiles a small batch of scripts, and the next batch is handed
+    # to the first process that finishes. Most expensive scripts are compiled
+    # first, so the end of the build is not spent waiting for a single
+    # process.
+    #   script_costs: NSS file => estimated compilation cost
+    #   build_diagnostics: list where diagnostics.Diagnostic objects parsed from
+    #       the compiler output are appended
+    #   failed_batches: list where batches compiled by processes that returned
+    #       an error are appended
+    def compile_files(
+        self,
+        working_dir,
+        script_list: list,
+        script_costs: dict = None,
+        build_diagnostics: list = None,
+        failed_batches: list = None,
+    ) -> int:
+        # Get compiler config
+        compiler_cmd = self.get_settings_value("compiler_cmd")
+        compiler_args = self.get_settings_value("compiler_args")
+        include_path = self.get_settings_value("include_path")
+        include_args = []
+        for inc in include_path:
+            include_args.extend(["-i", inc])
+
+        base_args = compiler_cmd + include_args + compiler_args + [
+            "-r", working_dir,
+            "-b", working_dir,
+        ]
+
+        jobs = self.get_settings_value("build_jobs") or multiprocessing.cpu_count()
+        max_batch_size = self.get_settings_value("build_batch_size") or 30
+
+        if script_costs is None:
+            script_costs = {}
+        queue = collections.deque(sorted(
+            script_list, key=lambda s: script_costs.get(s, 1), reverse=True
+        ))
+        remaining_cost = sum(script_costs.get(s, 1) for s in queue)
+        queue_lock = threading.Lock()
+
+        # Take out scripts to build in the next batch. Batches get smaller
+        # towards the end of the build.
+        def take_batch() -> list:
+            nonlocal remaining_cost
+            with queue_lock:
+                if self.stop_build:
+                    return []
+                target_cost = remaining_cost / (jobs * 2)
+                batch = []
+                batch_cost = 0
+                while len(queue) > 0 and len(batch) < max_batch_size and (len(batch) == 0 or batch_cost < target_cost):
+                    script = queue.popleft()
+                    batch.append(script)
+                    batch_cost += script_costs.get(script, 1)
+                remaining_cost -= batch_cost
+                return batch
+
+        timings = self.get_timings(working_dir)
+        timings.batches = []
+
+        status = 0
+        def worker():
+            nonlocal status
+            while True:
+                batch = take_batch()
+                if len(batch) == 0:
+                    return
+                # (read time, script name) of the lines announcing the
+                # compilation of each script
+                compiling_lines = []
+                def on_compiler_line(line, read_time):
+                    script_name = diagnostics.parse_compiling_line(line)
+                    if script_name is not None:
+                        compiling_lines.append((read_time, script_name))
+
+                batch_start = time.monotonic()
+                ret = self.run_compiler(working_dir, base_args + batch, on_compiler_line)
+                batch_end = time.monotonic()
+                if ret != 0:
+                    status = ret
+                    if failed_batches is not None:
+                        failed_batches.append(batch)
+                if self.stop_build:
+                    continue
+
+                script_times, is_measured = self.get_batch_script_times(
+                    batch, script_costs, compiling_lines, batch_start, batch_end
+                )
+                timings.record_batch(len(batch), script_times, batch_end - batch_start, is_measured)
+
+        self.started_processes = []
+        on_line = None
+        if build_diagnostics is not None:
+            def on_line(line):
+                diag = diagnostics.parse_line(line)
+                if diag is not None:
+                    build_diagnostics.append(diag)
+        self.output = output.OutputAggregator(self.print_build_results, on_line=on_line)
+        workers = [
+            threading.Thread(target=worker)
+            for _ in range(min(jobs, len(queue)))
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        self.output.close()
+
+        self.started_processes = []
+        self.save_timings(working_dir)
+
+        # Return 0 if no error, otherwise != 0
+        return status
+
+    # Compile time of each script of a batch
+    #   compiling_lines: (read time, script name) of the lines announcing the
+    #       compilation of each script, see diagnostics.parse_compiling_line
+    # Each script is timed from its line to the next one, or to the end of the
+    # process. When the compiler does not print these lines, or when its output
+    # is buffered and several of these lines are read at once, the batch
+    # duration is spread across its scripts according to their estimated cost.
+    # A single line does not tell if the output is buffered, so batches of one
+    # script are timed with the batch duration.
+    # Returns a (script name => compile time, is measured) tuple
+    @staticmethod
+    def get_batch_script_times(
+        batch: list, script_costs: dict, compiling_lines: list, batch_start: float, batch_end: float
+    ) -> (dict, bool):
+        batch_names = set(os.path.splitext(os.path.basename(s))[0].lower() for s in batch)
+        lines = [(read_time, name) for (read_time, name) in compiling_lines if name in batch_names]
+
+        if len(lines) > 1 and len(set(read_time for (read_time, _) in lines)) == len(lines):
+            script_times = {}
+            for i, (read_time, name) in enumerate(lines):
+                end_time = lines[i + 1][0] if i + 1 < len(lines) else batch_end
+                script_times[name] = script_times.get(name, 0.0) + end_time - read_time
+            return (script_times, True)
+
+        batch_cost = sum(script_costs.get(s, 1) for s in batch)
+        return ({
+            os.path.splitext(os.path.basename(s))[0].lower():
+                (batch_end - batch_start) * script_costs.get(s, 1) / batch_cost
+            for s in batch
+        }, False)
+
+    # Run a compiler process, forward its output to the build results and
+    # wait for it to finish. Returns the process exit code.
+    #   on_line: called with each line of output of the process and the time it
+    #       was read at, see output.OutputAggregator.add_stream
+    def run_compiler(self, working_dir: str, args: list, on_line: Callable[[str, float], None] = None) -> int:
+        # Windows only: prevent cmd from showing on screen
+        si = None
+        if os.name == 'nt':
+            si = subprocess.STARTUPINFO()
+            si.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        try:
+            # Start compiler process
+            proc = subprocess.Popen(
+                args,
+                cwd=working_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=False,
+                startupinfo=si,
+            )
+        except Exception as e:
+            self.print_build_results("nwscript-smartbuild error: %s\n" % e)
+            return -1
+        self.started_processes.append(proc)
+        if self.stop_build:
+            proc.terminate()
+
+        # Redirect stdout & stderr to build results
+        streams = [
+            self.output.add_stream(proc.stdout, on_line),
+            self.output.add_stream(proc.stderr, on_line),
+        ]
+
+        ret = proc.wait()
+        # The pipes normally end with the process, but processes it started
+        # (like wineserver) may keep them open
+        deadline = time.monotonic() + self.STREAM_END_TIMEOUT
+        for stream in streams:
+            if not stream.done.wait(max(0.0, deadline - time.monotonic())):
+                self.output.close_stream(stream)
+        return ret
+
+    @staticmethod
+    def script_list_to_str(lst: list):
+        if len(lst) < 100:
+            return ", ".join(lst)
+        return ", ".join(list(lst)[0:100]) + " and more..."
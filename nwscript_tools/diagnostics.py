@@ -0,0 +1,62 @@
+import re
+
+# Diagnostics parsed from NWNScriptCompiler output, for example:
+#   inc_common.nss(12): Error: NSC1020: Undeclared identifier "oPC"
+
+rgx_diagnostic = re.compile(r'^\s*([^(]+)\(([0-9]+)\): (Error|Warning): (?:(NSC[0-9]+): )?(.*?)\s*$')
+
+# Printed by the compiler before compiling each script, depending on its
+# arguments:
+#   Compiling: inc_common.nss
+rgx_compiling = re.compile(r'^\s*Compiling: (.+?)\s*$')
+
+
+class Diagnostic:
+    def __init__(self, file: str, line: int, severity: str, code: str, message: str):
+        # File name as printed by the compiler
+        self.file = file
+        # Line number, starting at 1
+        self.line = line
+        # "Error" or "Warning"
+        self.severity = severity
+        # Compiler message code, like "NSC1020", or None
+        self.code = code
+        self.message = message
+
+    # Lower case name of the script containing the diagnostic
+    def get_script_name(self) -> str:
+        name = self.file.replace("\\", "/").rsplit("/", 1)[-1]
+        if name.lower().endswith(".nss"):
+            name = name[:-4]
+        return name.lower()
+
+    def format(self) -> str:
+        if self.code is not None:
+            return "%s: %s: %s" % (self.severity, self.code, self.message)
+        return "%s: %s" % (self.severity, self.message)
+
+
+# Parse a line of compiler output. Returns None if the line is not a diagnostic.
+def parse_line(line: str) -> Diagnostic:
+    # Most lines are not diagnostics, avoid running the regex on them
+    if "): " not in line:
+        return None
+    match = rgx_diagnostic.match(line)
+    if match is None:
+        return None
+    file, line_number, severity, code, message = match.groups()
+    return Diagnostic(file.strip(), int(line_number), severity, code, message)
+
+
+# Parse a line of compiler output announcing the compilation of a script.
+# Returns the lower case name of the script, or None.
+def parse_compiling_line(line: str) -> str:
+    if "Compiling: " not in line:
+        return None
+    match = rgx_compiling.match(line)
+    if match is None:
+        return None
+    name = match.group(1).replace("\\", "/").rsplit("/", 1)[-1]
+    if name.lower().endswith(".nss"):
+        name = name[:-4]
+    return name.lower()
@@ -0,0 +1,120 @@
+import os
+import stat
+import threading
+
+# Directory scanning shared by the builder and the completion engine.
+#
+# os.scandir returns the file type along with each directory entry, and on
+# Windows the full stat result too. Scanning a directory this way costs a
+# single stat call per script file on POSIX (and none on Windows), instead of
+# a listdir + isfile + getmtime per file.
+
+SCRIPT_EXTENSIONS = (".nss", ".ncs")
+
+
+# Cached listing of the script files contained in a directory
+class ScriptDir:
+    def __init__(self, path: str):
+        self.path = path
+
+        # mtime of the directory when it was last scanned. Adding, removing or
+        # renaming a file changes the directory mtime.
+        self.mtime = None
+
+        # file name => os.stat_result, for NSS and NCS files
+        self.entries = {}
+
+        # lower case resref => NSS file name
+        self.nss_files = {}
+
+        self.lock = threading.Lock()
+
+    # List all script files in the directory
+    # Returns the new file name => os.stat_result dict
+    def scan(self) -> dict:
+        try:
+            dir_mtime = os.stat(self.path).st_mtime
+        except OSError:
+            dir_mtime = None
+
+        entries = {}
+        nss_files = {}
+        if dir_mtime is not None:
+            with os.scandir(self.path) as it:
+                for entry in it:
+                    resref, ext = os.path.splitext(entry.name)
+                    ext = ext.lower()
+                    if ext not in SCRIPT_EXTENSIONS:
+                        continue
+                    try:
+                        if not entry.is_file():
+                            continue
+                        entry_stat = entry.stat()
+                    except OSError:
+                        continue
+                    if not stat.S_ISREG(entry_stat.st_mode):
+                        continue
+
+                    entries[entry.name] = entry_stat
+                    if ext == ".nss":
+                        nss_files.setdefault(resref.lower(), entry.name)
+
+        with self.lock:
+            self.mtime = dir_mtime
+            self.entries = entries
+            self.nss_files = nss_files
+        return entries
+
+    # Scan the directory again if files have been added / removed since the
+    # last scan. Returns True if the directory has been scanned.
+    def refresh(self) -> bool:
+        try:
+            dir_mtime = os.stat(self.path).st_mtime
+        except OSError:
+            dir_mtime = None
+
+        if self.mtime is not None and dir_mtime == self.mtime:
+            return False
+        self.scan()
+        return True
+
+    # Return the path of the NSS file matching resref (case insensitive), or
+    # None if there is none
+    def find_nss(self, resref: str, refresh: bool = True) -> str:
+        if refresh:
+            self.refresh()
+        filename = self.nss_files.get(resref.lower())
+        if filename is None:
+            return None
+        return os.path.join(self.path, filename)
+
+    # Return the names of all NSS files, without extension
+    def list_nss(self, refresh: bool = True) -> list:
+        if refresh:
+            self.refresh()
+        with self.lock:
+            return [os.path.splitext(filename)[0] for filename in self.nss_files.values()]
+
+
+_script_dirs = {}
+_script_dirs_lock = threading.Lock()
+
+
+# Return the shared ScriptDir object for a given directory
+def get_script_dir(path: str) -> ScriptDir:
+    with _script_dirs_lock:
+        script_dir = _script_dirs.get(path)
+        if script_dir is None:
+            script_dir = ScriptDir(path)
+            _script_dirs[path] = script_dir
+        return script_dir
+
+
+# Search through a list of directories to find the NSS file matching resref
+#   refresh: False to use the directory listings from the last scan
+def find_nss(path_list: list, resref: str, refresh: bool = True) -> str:
+    for path in path_list:
+        file = get_script_dir(path).find_nss(resref, refresh)
+        if file is not None:
+            return file
+    return None
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import threading
+from . import parser
+
+# Script metadata shared by the builder and the completion engine, so each
+# script is read and parsed once per modification, and both see the same
+# includes and main functions.
+#
+# Only small per-script information is kept for every script. Declarations
+# are returned to the caller of MetadataStore.read, and the completion engine
+# keeps them under its own size limit.
+
+
+class ScriptMetadata:
+    __slots__ = ("mtime", "size", "sha1", "code_sha1", "has_main", "includes")
+
+    def __init__(self):
+        self.mtime = None
+        self.size = None
+        # SHA-1 of the file content
+        self.sha1 = None
+        # SHA-1 of the file content without comments and formatting, see
+        # parser.normalize_code. None unless requested when reading the script.
+        self.code_sha1 = None
+        # True if the script has a main or StartingConditional function
+        self.has_main = False
+        # Resrefs of the included scripts, as written in the script
+        self.includes = []
+
+
+class MetadataStore:
+    def __init__(self):
+        # normalized file path => ScriptMetadata
+        self.scripts = {}
+        self.lock = threading.Lock()
+
+    # Return the metadata of a script, parsing it only if it has been modified
+    # since the last call
+    #   file_stat: os.stat result of the file, if already known
+    #   with_code_sha1: compute ScriptMetadata.code_sha1
+    def get(self, file_path: str, file_stat: os.stat_result = None, with_code_sha1: bool = False) -> ScriptMetadata:
+        if file_stat is None:
+            file_stat = os.stat(file_path)
+
+        metadata = self.get_cached(file_path, file_stat)
+        if metadata is not None and (not with_code_sha1 or metadata.code_sha1 is not None):
+            return metadata
+        return self.read(file_path, file_stat, with_code_sha1=with_code_sha1)[0]
+
+    # Return the metadata of a script if it has not been modified since it was
+    # last read, or None
+    def get_cached(self, file_path: str, file_stat: os.stat_result) -> ScriptMetadata:
+        metadata = self.scripts.get(os.path.normcase(file_path))
+        if metadata is not None and metadata.mtime == file_stat.st_mtime and metadata.size == file_stat.st_size:
+            return metadata
+        return None
+
+    # Return True if a script has a main or StartingConditional function.
+    # Scripts that do not contain these names at all are not parsed.
+    def get_has_main(self, file_path: str, file_stat: os.stat_result = None) -> bool:
+        if file_stat is None:
+            file_stat = os.stat(file_path)
+
+        metadata = self.get_cached(file_path, file_stat)
+        if metadata is not None:
+            return metadata.has_main
+
+        with open(file_path, "rb") as file:
+            raw_data = file.read()
+        if b"main" not in raw_data and b"StartingConditional" not in raw_data:
+            return False
+        return self.read(file_path, file_stat, raw_data)[0].has_main
+
+    # Read and parse a script, and update its metadata
+    #   raw_data: file content, if already read
+    #   with_code_sha1: compute ScriptMetadata.code_sha1
+    # Returns a (ScriptMetadata, declarations) tuple, declarations being the
+    # list returned by nwscript_tools.parser.parse
+    def read(
+        self,
+        file_path: str,
+        file_stat: os.stat_result = None,
+        raw_data: bytes = None,
+        with_code_sha1: bool = False,
+    ) -> (ScriptMetadata, list):
+        if raw_data is None:
+            with open(file_path, "rb") as file:
+                if file_stat is None:
+                    file_stat = os.fstat(file.fileno())
+                raw_data = file.read()
+        elif file_stat is None:
+            file_stat = os.stat(file_path)
+
+        resref = os.path.splitext(os.path.basename(file_path))[0]
+        data = raw_data.decode("utf-8", errors="ignore")
+        decls, has_main = parser.parse(data, resref.lower() == "nwscript")
+
+        metadata = ScriptMetadata()
+        metadata.mtime = file_stat.st_mtime
+        metadata.size = file_stat.st_size
+        metadata.sha1 = hashlib.sha1(raw_data).hexdigest()
+        if with_code_sha1:
+            metadata.code_sha1 = hashlib.sha1(parser.normalize_code(data).encode("utf-8")).hexdigest()
+        metadata.has_main = has_main
+        metadata.includes = parser.get_includes(decls)
+
+        with self.lock:
+            self.scripts[os.path.normcase(file_path)] = metadata
+        return (metadata, decls)
+
+
+_store = MetadataStore()
+
+
+# Return the metadata store shared by all users in this process
+def get_store() -> MetadataStore:
+    return _store
@@ -0,0 +1,181 @@
+import os
+import selectors
+import threading
+import time
+from typing import Callable
+
+# Output aggregator for the compiler processes of a build.
+#
+# Output of all processes is read by a single thread (through a selector on
+# POSIX, Windows pipes cannot be selected and use one reader thread per pipe),
+# split on whole lines so lines of different processes are never mixed, and
+# written to the build results at most once per flush interval.
+
+
+class OutputStream:
+    def __init__(self, handle, on_line: Callable[[str, float], None] = None):
+        self.handle = handle
+        self.on_line = on_line
+        # Bytes read after the last line ending
+        self.buffer = b''
+        # Set when the whole stream has been read, or the stream closed
+        self.done = threading.Event()
+        # Set by OutputAggregator.close_stream
+        self.closed = False
+
+
+class OutputAggregator:
+    #   write: function writing text to the build results
+    #   flush_interval: minimum delay in seconds between two calls to write
+    #   on_line: function called with each line of output, without line ending
+    #   encoding: encoding of the process output
+    def __init__(
+        self,
+        write: Callable[[str], None],
+        flush_interval: float = 0.1,
+        on_line: Callable[[str], None] = None,
+        encoding: str = "cp850",
+    ):
+        self.write = write
+        self.flush_interval = flush_interval
+        self.on_line = on_line
+        self.encoding = encoding
+
+        # Text waiting to be written
+        self.pending = []
+        # Streams to close, see close_stream
+        self.closing = []
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.selector = selectors.DefaultSelector() if os.name != "nt" else None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Start reading a process pipe
+    #   on_line: function called with each line of this stream, without line
+    #       ending, and the time.monotonic() time it was read at. Lines read
+    #       together have the same time.
+    # Returns the OutputStream, whose done event is set once the pipe has been
+    # read entirely
+    def add_stream(self, handle, on_line: Callable[[str, float], None] = None) -> OutputStream:
+        stream = OutputStream(handle, on_line)
+        if self.selector is not None:
+            self.selector.register(handle, selectors.EVENT_READ, stream)
+        else:
+            threading.Thread(target=self.read_stream, args=(stream,), daemon=True).start()
+        return stream
+
+    # Stop reading a stream before its end, for example when the pipe is kept
+    # open by a process started by the one writing to it. Output read so far
+    # is kept.
+    def close_stream(self, stream: OutputStream) -> None:
+        with self.condition:
+            self.closing.append(stream)
+            self.condition.notify()
+        stream.done.wait()
+
+    def close_pending_streams(self) -> None:
+        with self.condition:
+            closing = self.closing
+            self.closing = []
+            for stream in closing:
+                if stream.done.is_set():
+                    continue
+                if self.selector is not None:
+                    self.selector.unregister(stream.handle)
+                    stream.handle.close()
+                # Windows: the reader thread may be blocked reading the pipe,
+                # it stops once the pipe is closed by the other processes
+                self.feed(stream, b'')
+                stream.closed = True
+
+    # Write the remaining output and stop the aggregator thread
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            self.close_pending_streams()
+            timeout = max(0.0, next_flush - time.monotonic())
+            if self.selector is not None and len(self.selector.get_map()) > 0:
+                for key, _ in self.selector.select(timeout):
+                    self.read_selected(key.data)
+            else:
+                with self.condition:
+                    if not self.closed:
+                        self.condition.wait(timeout)
+
+            if self.closed and (self.selector is None or len(self.selector.get_map()) == 0):
+                self.flush()
+                return
+
+            if time.monotonic() >= next_flush:
+                self.flush()
+                next_flush = time.monotonic() + self.flush_interval
+
+    def read_selected(self, stream: OutputStream) -> None:
+        try:
+            data = os.read(stream.handle.fileno(), 2 ** 13)
+        except OSError:
+            data = b''
+        if data == b'':
+            self.selector.unregister(stream.handle)
+        self.feed(stream, data)
+
+    # Windows only: read a pipe in its own thread
+    def read_stream(self, stream: OutputStream) -> None:
+        while True:
+            try:
+                data = os.read(stream.handle.fileno(), 2 ** 13)
+            except OSError:
+                data = b''
+            with self.condition:
+                if stream.closed:
+                    return
+                self.feed(stream, data)
+            if data == b'':
+                return
+
+    # Add data read from a stream. Empty data means the end of the stream.
+    def feed(self, stream: OutputStream, data: bytes) -> None:
+        read_time = time.monotonic()
+        if data != b'':
+            stream.buffer += data
+            end = stream.buffer.rfind(b'\n')
+            if end < 0:
+                return
+            chunk = stream.buffer[:end + 1]
+            stream.buffer = stream.buffer[end + 1:]
+        else:
+            chunk = stream.buffer
+            stream.buffer = b''
+
+        if chunk != b'':
+            text = chunk.decode(self.encoding, errors="replace").replace("\r\n", "\n")
+            if not text.endswith("\n"):
+                # Last line of the stream, keep the next output on its own line
+                text += "\n"
+            if self.on_line is not None or stream.on_line is not None:
+                for line in text.splitlines():
+                    if self.on_line is not None:
+                        self.on_line(line)
+                    if stream.on_line is not None:
+                        stream.on_line(line, read_time)
+            with self.condition:
+                self.pending.append(text)
+
+        if data == b'':
+            stream.done.set()
+
+    def flush(self) -> None:
+        with self.condition:
+            if len(self.pending) == 0:
+                return
+            text = "".join(self.pending)
+            self.pending = []
+        self.write(text)
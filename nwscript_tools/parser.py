@@ -0,0 +1,285 @@
+import re
+
+# NWScript declaration scanner used by the completion engine.
+#
+# Declarations are returned as tuples, similar to Documentation.signature
+# with the documentation text appended:
+#   ("f", type, name, args, doc)  function, args is a tuple of
+#                                 (type, name, default value or None)
+#   ("c", type, name, value, doc) constant
+#   ("d", name, value, doc)       #define
+#   ("s", name, doc)              struct
+#   ("i", resref)                 #include
+# doc is None when there is no documentation comment.
+
+nwn_types = r'(void|string|int|float|object|vector|location|effect|event|talent|itemproperty|action|sqlquery|json|struct\s+\w+)'
+
+# Tokens needed to find top-level statements. Any other text is skipped.
+rgx_token = re.compile(
+    r'(//[^\n]*)'                      # 1: line comment
+    r'|(/\*.*?(?:\*/|\Z))'              # 2: block comment
+    r'|("(?:\\.|[^"\\\n])*"?)'          # 3: string
+    r'|(#[^\n]*)'                      # 4: preprocessor line
+    r'|([{};\n])',                     # 5: brace, end of statement or new line
+    re.DOTALL)
+
+# Top-level statements, matched against the text between the start of the
+# statement and its terminating ; or {
+rgx_stmt_fun = re.compile(nwn_types + r'\s+(\w+)\s*\(([^)]*)\)\s*\Z')
+rgx_stmt_const = re.compile(r'const\s+' + nwn_types + r'\s+(\w+)\s*=\s*(.+?)\s*\Z', re.DOTALL)
+rgx_stmt_nwscript = re.compile(nwn_types + r'\s+(\w+)\s*=\s*(.+?)\s*\Z', re.DOTALL)
+rgx_stmt_struct = re.compile(r'struct\s+(\w+)\s*\Z')
+rgx_define = re.compile(r'#\s*define\s+(\w+)\s+(.+?)\s*\Z')
+rgx_include = re.compile(r'#\s*include\s+"([^"]+?)(?:\.nss)?"', re.IGNORECASE)
+
+rgx_fun_arg = re.compile(
+    nwn_types + r'\s+'
+    r'(\w+)'
+    r'(?:\s*=\s*(".*?"|\[.*?\]|[-\w\."]+))?',
+    re.DOTALL)
+
+# Scripts are scanned by blocks of text separated by blank lines. Block
+# comments and function bodies can contain blank lines, so the state at the
+# end of a block is passed to the next one. Top-level statements are assumed
+# to never span over blank lines.
+rgx_blank_lines = re.compile(r'\n[ \t]*\n')
+
+# Scanner state between blocks: (brace depth, inside a block comment)
+initial_state = (0, False)
+
+
+def remove_comments(comm: str) -> str:
+    if comm == "" or comm.isspace():
+        return None
+    return "\n".join([
+        (line[3:] if len(line) > 2 and line[2] == ' ' else line[2:])
+        for line in comm.splitlines()
+    ])
+
+
+# Extract all declarations from a block of text, in a single pass
+#   state: scanner state at the end of the previous block
+# Returns a (declarations, has_main, state at the end of the block) tuple
+def parse_block(data: str, is_nwscript: bool, state: tuple = initial_state) -> (list, bool, tuple):
+    decls = []
+    has_main = False
+
+    depth, in_comment = state
+    start = 0
+    if in_comment:
+        # Skip the end of a block comment started in a previous block
+        start = data.find("*/")
+        if start < 0:
+            return (decls, has_main, state)
+        start += 2
+    in_comment = False
+
+    # Start of the current line, and of the current top-level statement
+    line_start = start
+    stmt_start = None
+    prev_end = start
+
+    # Lines of the // comments directly above the current line, and above the
+    # current statement
+    doc_lines = []
+    newlines_since_doc = 0
+    stmt_doc_lines = []
+    # Index in decls of a constant whose documentation may follow on the same line
+    const_index = None
+
+    for match in rgx_token.finditer(data, start):
+        kind = match.lastindex
+        token = match.group(kind)
+        pos = match.start()
+
+        if depth == 0 and stmt_start is None and prev_end < pos:
+            # Find the start of a statement in the skipped text
+            gap = data[prev_end:pos]
+            stripped = gap.lstrip()
+            if stripped != "":
+                stmt_start = pos - len(stripped)
+                stmt_doc_lines = doc_lines if newlines_since_doc == 1 else []
+        prev_end = match.end()
+
+        if kind == 5 and token == "\n":
+            line_start = match.end()
+            newlines_since_doc += 1
+            const_index = None
+            continue
+
+        if kind == 1:
+            if depth != 0:
+                continue
+            if const_index is not None:
+                # Constant documentation: const int A = 1; // doc
+                const_doc = token[2:].lstrip()
+                if const_doc != "" and not const_doc.isspace():
+                    decl = decls[const_index]
+                    decls[const_index] = decl[:4] + (const_doc,)
+                const_index = None
+            elif stmt_start is None and data[line_start:pos].strip() == "":
+                # Comment on its own line
+                if newlines_since_doc != 1:
+                    doc_lines = []
+                doc_lines.append(data[line_start:match.end()])
+                newlines_since_doc = 0
+            continue
+
+        if kind == 3:
+            continue
+
+        if kind == 2:
+            if depth == 0 and stmt_start is None:
+                doc_lines = []
+            # Block comment continuing in the next block
+            in_comment = len(token) < 4 or not token.endswith("*/")
+            continue
+
+        if kind == 4:
+            include = rgx_include.match(token)
+            if include is not None:
+                decls.append(("i", include.group(1)))
+            if depth == 0:
+                stmt_start = None
+                define = rgx_define.match(token)
+                if define is not None:
+                    decls.append((
+                        "d", define.group(1), define.group(2),
+                        "\n".join([line[2:] for line in doc_lines])
+                        if len(doc_lines) > 0 and newlines_since_doc == 1
+                        else None
+                    ))
+                doc_lines = []
+            continue
+
+        if token == "}":
+            if depth > 0:
+                depth -= 1
+            continue
+
+        # ; or {
+        if depth == 0 and stmt_start is not None:
+            stmt = data[stmt_start:pos]
+            decl_has_main = parse_statement(stmt, token, stmt_doc_lines, is_nwscript, decls)
+            has_main = has_main or decl_has_main
+            if token == ";" and len(decls) > 0 and decls[-1][0] == "c":
+                const_index = len(decls) - 1
+            stmt_start = None
+            doc_lines = []
+        if token == "{":
+            depth += 1
+
+    return (decls, has_main, (depth, in_comment))
+
+
+# Extract the declaration of a top-level statement, and append it to decls
+#   terminator: ";" or "{"
+#   doc_lines: // comment lines directly above the statement
+# Returns True if the statement is a main or StartingConditional function
+def parse_statement(stmt: str, terminator: str, doc_lines: list, is_nwscript: bool, decls: list) -> bool:
+    fun = rgx_stmt_fun.match(stmt)
+    if fun is not None:
+        fun_type, fun_name, fun_args = fun.groups()
+        if fun_name in ("main", "StartingConditional"):
+            # Only the definition of the function makes a script compilable
+            return terminator == "{"
+
+        args = []
+        if fun_args != "" and not fun_args.isspace():
+            for (arg_type, arg_name, arg_value) in rgx_fun_arg.findall(fun_args):
+                if arg_value == "" or arg_value.isspace():
+                    arg_value = None
+                args.append((arg_type, arg_name, arg_value))
+        decls.append(("f", fun_type, fun_name, tuple(args), remove_comments("\n".join(doc_lines))))
+        return False
+
+    if terminator == "{":
+        struct = rgx_stmt_struct.match(stmt)
+        if struct is not None:
+            decls.append(("s", struct.group(1), remove_comments("\n".join(doc_lines))))
+        return False
+
+    glob = (rgx_stmt_nwscript if is_nwscript else rgx_stmt_const).match(stmt)
+    if glob is not None:
+        decls.append(("c", glob.group(1), glob.group(2), glob.group(3), None))
+    return False
+
+
+# Extract all declarations from a script
+# Returns a (declarations, has_main) tuple
+def parse(data: str, is_nwscript: bool) -> (list, bool):
+    decls = []
+    has_main = False
+    state = initial_state
+    for block in rgx_blank_lines.split(data):
+        block_decls, block_has_main, state = parse_block(block, is_nwscript, state)
+        decls.extend(block_decls)
+        has_main = has_main or block_has_main
+    return (decls, has_main)
+
+
+# Return the resrefs of the scripts included in a list of declarations
+def get_includes(decls: list) -> list:
+    return [decl[1] for decl in decls if decl[0] == "i"]
+
+
+rgx_code_string = r'("(?:\\.|[^"\\\n])*"?)'
+rgx_code_comment = re.compile(r'//[^\n]*|/\*.*?(?:\*/|\Z)|' + rgx_code_string, re.DOTALL)
+rgx_code_space = re.compile(rgx_code_string + r'|(#[^\n]*)|\s+')
+# Whitespace of a preprocessor line, outside strings
+rgx_code_line_space = re.compile(rgx_code_string + r'|\s+')
+
+
+# Return the script text without comments and with normalized whitespace, so
+# only changes to the code itself change the result. Strings are kept as is,
+# and preprocessor lines are kept on their own line.
+def normalize_code(data: str) -> str:
+    def replace_space(match):
+        if match.group(1) is not None:
+            return match.group(1)
+        if match.group(2) is not None:
+            line = rgx_code_line_space.sub(
+                lambda m: m.group(1) if m.group(1) is not None else " ", match.group(2)
+            )
+            return "\n" + line.strip() + "\n"
+        # Whitespace next to punctuation does not separate anything
+        start, end = match.span()
+        if start == 0 or end == len(data) or data[start - 1] in "(){}[];," or data[end] in "(){}[];,":
+            return ""
+        return " "
+
+    data = rgx_code_comment.sub(lambda m: m.group(1) if m.group(1) is not None else " ", data)
+    return rgx_code_space.sub(replace_space, data).strip()
+
+
+# Parser for a script that is being edited. Results of each block of text are
+# kept, so only the blocks modified since the previous call, or whose scanner
+# state changed, are scanned again.
+class IncrementalParser:
+    def __init__(self, is_nwscript: bool):
+        self.is_nwscript = is_nwscript
+
+        # (scanner state, block text) => (declarations, has_main, scanner state)
+        self.blocks = {}
+
+    # Returns a (declarations, has_main) tuple
+    def parse(self, data: str) -> (list, bool):
+        decls = []
+        has_main = False
+        blocks = {}
+        state = initial_state
+        for block in rgx_blank_lines.split(data):
+            key = (state, block)
+            result = blocks.get(key)
+            if result is None:
+                result = self.blocks.get(key)
+                if result is None:
+                    result = parse_block(block, self.is_nwscript, state)
+                blocks[key] = result
+            decls.extend(result[0])
+            has_main = has_main or result[1]
+            state = result[2]
+
+        # Only keep current blocks
+        self.blocks = blocks
+        return (decls, has_main)
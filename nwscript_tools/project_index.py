@@ -0,0 +1,296 @@
+import bisect
+import hashlib
+import json
+import os
+import re
+import threading
+from . import dirscan, metadata, parser
+from .build import write_json_file
+
+# Symbol definitions and function call sites of all the scripts contained in
+# a list of directories (usually the module directory and the include path).
+#
+# Each directory is indexed separately and stored in the cache directory, so
+# only scripts modified since the last update are scanned again.
+#
+# Positions are (line, column), both starting at 1.
+
+# Comments and strings, replaced by spaces before scanning a script
+rgx_ignored = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"', re.DOTALL)
+rgx_not_newline = re.compile(r'[^\n]')
+
+rgx_def_fun = re.compile(r'^[ \t]*' + parser.nwn_types + r'\s+(\w+)\s*\(', re.MULTILINE)
+rgx_def_const = re.compile(r'^[ \t]*const\s+' + parser.nwn_types + r'\s+(\w+)\s*=', re.MULTILINE)
+rgx_def_nwscript = re.compile(r'^[ \t]*' + parser.nwn_types + r'\s+(\w+)\s*=', re.MULTILINE)
+rgx_def_define = re.compile(r'^[ \t]*#\s*define\s+(\w+)', re.MULTILINE)
+rgx_def_struct = re.compile(r'^[ \t]*struct\s+(\w+)\s*\{', re.MULTILINE)
+rgx_call = re.compile(r'\b([A-Za-z_]\w*)\s*\(')
+
+NOT_FUNCTIONS = {"if", "while", "for", "switch", "return", "sizeof", "main", "StartingConditional"}
+
+
+# Extract symbol definitions and function calls from a script
+# Returns a (definitions, calls) tuple:
+#   definitions: list of (name, kind, line, column), kind being "f", "c", "d"
+#       or "s" like in nwscript_tools.parser declarations
+#   calls: list of (name, line, column)
+def scan_script(data: str, is_nwscript: bool) -> (list, list):
+    data = rgx_ignored.sub(lambda m: rgx_not_newline.sub(" ", m.group(0)), data)
+
+    line_starts = [0]
+    pos = data.find("\n")
+    while pos >= 0:
+        line_starts.append(pos + 1)
+        pos = data.find("\n", pos + 1)
+
+    def get_position(offset):
+        line = bisect.bisect_right(line_starts, offset)
+        return (line, offset - line_starts[line - 1] + 1)
+
+    definitions = []
+    def_offsets = set()
+    for kind, rgx in (
+        ("f", rgx_def_fun),
+        ("c", rgx_def_nwscript if is_nwscript else rgx_def_const),
+        ("d", rgx_def_define),
+        ("s", rgx_def_struct),
+    ):
+        for match in rgx.finditer(data):
+            group = match.lastindex
+            name = match.group(group)
+            if kind == "f" and name in NOT_FUNCTIONS:
+                continue
+            def_offsets.add(match.start(group))
+            definitions.append((name, kind) + get_position(match.start(group)))
+
+    calls = []
+    for match in rgx_call.finditer(data):
+        name = match.group(1)
+        if name in NOT_FUNCTIONS or match.start(1) in def_offsets:
+            continue
+        calls.append((name,) + get_position(match.start(1)))
+
+    return (definitions, calls)
+
+
+# Index of the scripts contained in a single directory
+class DirIndex:
+    # Must be incremented each time the file format or the information
+    # extracted by scan_script changes
+    VERSION = 1
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+        # NSS file name => (mtime, size, definitions, calls)
+        self.files = {}
+
+        self.modified = False
+
+    @staticmethod
+    def load(cache_file: str, directory: str) -> "DirIndex":
+        index = DirIndex(directory)
+        try:
+            with open(cache_file, "r", encoding="utf-8") as file:
+                data = json.load(file)
+            if data.get("version") != DirIndex.VERSION or data.get("directory") != directory:
+                return index
+            index.files = {
+                filename: (
+                    mtime, size,
+                    [tuple(definition) for definition in definitions],
+                    [tuple(call) for call in calls],
+                )
+                for filename, (mtime, size, definitions, calls) in data["files"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print("nwscript-index: ignoring invalid index file %s: %s" % (cache_file, e))
+            return DirIndex(directory)
+        return index
+
+    def save(self, cache_file: str) -> None:
+        if not self.modified:
+            return
+        write_json_file(cache_file, {
+            "version": DirIndex.VERSION,
+            "directory": self.directory,
+            "files": self.files,
+        })
+        self.modified = False
+
+    # Scan scripts modified since the last update
+    # Returns the list of added, modified or removed file names
+    def update(self) -> list:
+        entries = dirscan.get_script_dir(self.directory).scan()
+
+        changed = []
+        nss_files = set()
+        for filename, file_stat in entries.items():
+            if os.path.splitext(filename)[1].lower() != ".nss":
+                continue
+            nss_files.add(filename)
+
+            previous = self.files.get(filename)
+            if previous is not None and previous[0] == file_stat.st_mtime and previous[1] == file_stat.st_size:
+                continue
+            if self.update_file(filename, file_stat):
+                changed.append(filename)
+
+        for filename in list(self.files.keys()):
+            if filename not in nss_files:
+                del self.files[filename]
+                self.modified = True
+                changed.append(filename)
+
+        return changed
+
+    # Scan a single script. Returns False if the file could not be read.
+    def update_file(self, filename: str, file_stat: os.stat_result = None) -> bool:
+        file_path = os.path.join(self.directory, filename)
+        try:
+            with open(file_path, "rb") as file:
+                if file_stat is None:
+                    file_stat = os.fstat(file.fileno())
+                raw_data = file.read()
+        except OSError:
+            if self.files.pop(filename, None) is not None:
+                self.modified = True
+                return True
+            return False
+
+        # Update the shared script metadata with the content read here, so
+        # the builder and the completion engine do not read the file again
+        store = metadata.get_store()
+        if store.get_cached(file_path, file_stat) is None:
+            store.read(file_path, file_stat, raw_data)
+
+        resref = os.path.splitext(filename)[0]
+        data = raw_data.decode("utf-8", errors="ignore").replace("\r\n", "\n")
+        definitions, calls = scan_script(data, resref.lower() == "nwscript")
+        self.files[filename] = (file_stat.st_mtime, file_stat.st_size, definitions, calls)
+        self.modified = True
+        return True
+
+
+# Lookup tables of the symbols defined in a list of directories
+class ProjectIndex:
+    #   directories: directories to index. When a script exists in multiple
+    #       directories, the first one is used.
+    #   cache_dir: where to store the index of each directory
+    def __init__(self, directories: list, cache_dir: str):
+        self.directories = directories
+        self.cache_dir = cache_dir
+
+        self.dir_indexes = {}
+
+        # symbol => list of (file path, line, column, kind)
+        self.definitions = {}
+        # symbol => list of (file path, line, column)
+        self.references = {}
+        # Sorted list of (symbol, kind, file path, line, column), built on demand
+        self.symbol_list = None
+
+        self.ready = False
+        self.lock = threading.Lock()
+        self.update_lock = threading.Lock()
+
+    def get_cache_file(self, directory: str) -> str:
+        key = os.path.normcase(os.path.abspath(directory)).encode("utf-8")
+        return os.path.join(self.cache_dir, hashlib.sha1(key).hexdigest() + ".symbols.json")
+
+    # Load the directory indexes from the cache, scan modified scripts and
+    # rebuild the lookup tables. Can be slow the first time, should be called
+    # from a side thread.
+    def update(self) -> None:
+        with self.update_lock:
+            changed = False
+            for directory in self.directories:
+                dir_index = self.dir_indexes.get(directory)
+                if dir_index is None:
+                    dir_index = DirIndex.load(self.get_cache_file(directory), directory)
+                    self.dir_indexes[directory] = dir_index
+                    changed = True
+                if len(dir_index.update()) > 0:
+                    changed = True
+                try:
+                    dir_index.save(self.get_cache_file(directory))
+                except OSError as e:
+                    print("nwscript-index: could not save index: %s" % e)
+
+            if changed or not self.ready:
+                self.build_tables()
+
+    # Scan a single script, usually after it has been saved, and update the
+    # lookup tables. Scripts of directories that have not been indexed yet
+    # are ignored, update will scan them.
+    def update_file(self, file_path: str) -> None:
+        directory = os.path.normcase(os.path.normpath(os.path.dirname(file_path)))
+        filename = os.path.basename(file_path)
+        if os.path.splitext(filename)[1].lower() != ".nss":
+            return
+
+        with self.update_lock:
+            for dir_path, dir_index in self.dir_indexes.items():
+                if os.path.normcase(os.path.normpath(dir_path)) != directory:
+                    continue
+                try:
+                    file_stat = os.stat(file_path)
+                except OSError:
+                    file_stat = None
+                previous = dir_index.files.get(filename)
+                if (
+                    previous is not None and file_stat is not None
+                    and previous[0] == file_stat.st_mtime and previous[1] == file_stat.st_size
+                ):
+                    return
+                if not dir_index.update_file(filename, file_stat):
+                    return
+                try:
+                    dir_index.save(self.get_cache_file(dir_path))
+                except OSError as e:
+                    print("nwscript-index: could not save index: %s" % e)
+                self.build_tables()
+                return
+
+    def build_tables(self) -> None:
+        definitions = {}
+        references = {}
+        seen_resrefs = set()
+        for directory in self.directories:
+            dir_index = self.dir_indexes[directory]
+            for filename, (_, _, file_defs, file_calls) in dir_index.files.items():
+                resref = os.path.splitext(filename)[0].lower()
+                if resref in seen_resrefs:
+                    continue
+                seen_resrefs.add(resref)
+
+                file_path = os.path.join(directory, filename)
+                for name, kind, line, column in file_defs:
+                    definitions.setdefault(name, []).append((file_path, line, column, kind))
+                for name, line, column in file_calls:
+                    references.setdefault(name, []).append((file_path, line, column))
+
+        with self.lock:
+            self.definitions = definitions
+            self.references = references
+            self.symbol_list = None
+            self.ready = True
+
+    def find_definitions(self, symbol: str) -> list:
+        return self.definitions.get(symbol, [])
+
+    def find_references(self, symbol: str) -> list:
+        return self.references.get(symbol, [])
+
+    # Returns the sorted list of (symbol, kind, file path, line, column) of
+    # all definitions
+    def get_symbol_list(self) -> list:
+        with self.lock:
+            if self.symbol_list is None:
+                self.symbol_list = sorted(
+                    (name, kind, file_path, line, column)
+                    for name, locations in self.definitions.items()
+                    for file_path, line, column, kind in locations
+                )
+            return self.symbol_list
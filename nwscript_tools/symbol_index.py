@@ -0,0 +1,113 @@
+import hashlib
+import json
+from typing import Callable
+from . import parser
+from .build import write_json_file
+
+# Precompiled symbol index of a script, used to avoid parsing the large stock
+# nwscript.nss file with regexes at the start of each session.
+#
+# The index contains the declarations returned by nwscript_tools.parser and
+# the documentation fixes of each function. It is only valid for the exact
+# script content and documentation fixes source (nwscript_doc_fixes.py) it
+# has been built from (checked with SHA-1 hashes).
+#
+# Build the index shipped with the package with:
+#   python -m nwscript_tools index path/to/nwscript.nss
+
+
+def get_data_hash(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+# Hash of the source code of nwscript_doc_fixes.py
+def get_doc_fixes_hash(source: str) -> str:
+    return get_data_hash(source.replace("\r\n", "\n").encode("utf-8"))
+
+
+class SymbolIndex:
+    # Must be incremented each time the file format or the declarations
+    # returned by nwscript_tools.parser change
+    VERSION = 5
+
+    def __init__(self):
+        self.sha1 = None
+        # get_doc_fixes_hash of the documentation fixes source
+        self.doc_fixes_sha1 = None
+        self.declarations = []
+        self.has_main = False
+        # function name => (severity, text)
+        self.doc_fixes = {}
+
+    # Build the index of a script
+    #   data: raw script content
+    #   get_doc_fix: function returning the documentation fix of a
+    #       (script resref, symbol), or None
+    #   doc_fixes_sha1: get_doc_fixes_hash of the source of get_doc_fix
+    @staticmethod
+    def build(
+        data: bytes, resref: str, get_doc_fix: Callable[[str, str], tuple], doc_fixes_sha1: str
+    ) -> "SymbolIndex":
+        index = SymbolIndex()
+        index.sha1 = get_data_hash(data)
+        index.doc_fixes_sha1 = doc_fixes_sha1
+        index.declarations, index.has_main = parser.parse(
+            data.decode("utf-8", errors="ignore"),
+            resref == "nwscript"
+        )
+        for decl in index.declarations:
+            if decl[0] == "f":
+                fix = get_doc_fix(resref, decl[2])
+                if fix is not None:
+                    index.doc_fixes[decl[2]] = tuple(fix)
+        return index
+
+    # Read an index from its JSON text
+    # Returns None if the index is invalid or does not match sha1 and
+    # doc_fixes_sha1
+    @staticmethod
+    def from_json(text: str, sha1: str, doc_fixes_sha1: str) -> "SymbolIndex":
+        try:
+            data = json.loads(text)
+            if (
+                data.get("version") != SymbolIndex.VERSION or data.get("sha1") != sha1
+                or data.get("doc_fixes_sha1") != doc_fixes_sha1
+            ):
+                return None
+
+            index = SymbolIndex()
+            index.sha1 = sha1
+            index.doc_fixes_sha1 = doc_fixes_sha1
+            index.has_main = data["has_main"]
+            # JSON arrays are converted back to tuples, so declarations can be
+            # used as dict keys
+            index.declarations = [
+                (decl[0], decl[1], decl[2], tuple(tuple(arg) for arg in decl[3]), decl[4])
+                if decl[0] == "f" else tuple(decl)
+                for decl in data["declarations"]
+            ]
+            index.doc_fixes = {name: tuple(fix) for name, fix in data["doc_fixes"].items()}
+        except (ValueError, KeyError, TypeError, IndexError, AttributeError) as e:
+            print("nwscript-completion: ignoring invalid symbol index: %s" % e)
+            return None
+        return index
+
+    # Returns None if the file does not exist, is invalid or does not match sha1
+    # and doc_fixes_sha1
+    @staticmethod
+    def load(index_file: str, sha1: str, doc_fixes_sha1: str) -> "SymbolIndex":
+        try:
+            with open(index_file, "r", encoding="utf-8") as file:
+                return SymbolIndex.from_json(file.read(), sha1, doc_fixes_sha1)
+        except OSError:
+            return None
+
+    def save(self, index_file: str) -> None:
+        write_json_file(index_file, {
+            "version": SymbolIndex.VERSION,
+            "sha1": self.sha1,
+            "doc_fixes_sha1": self.doc_fixes_sha1,
+            "has_main": self.has_main,
+            "declarations": self.declarations,
+            "doc_fixes": self.doc_fixes,
+        })
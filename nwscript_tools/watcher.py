@@ -0,0 +1,161 @@
+import os
+import sys
+import struct
+import ctypes
+import ctypes.util
+from . import dirscan
+
+# Directory watchers report the names of the files that changed in a
+# directory since the previous call to pop_changes(), so callers can avoid
+# going through every file in the directory.
+#
+# pop_changes() returns None when the watcher cannot tell what changed (first
+# call, or events were lost), meaning the directory must be fully rescanned.
+
+
+class DirWatcher:
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def pop_changes(self) -> set:
+        return None
+
+    # True if the watcher stopped working and must be re-created
+    def is_broken(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        pass
+
+
+# Linux inotify backend
+class InotifyWatcher(DirWatcher):
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+
+    WATCH_MASK = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+        | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+    )
+
+    _libc = None
+    _event_header = struct.Struct("iIII")
+
+    @classmethod
+    def is_available(cls) -> bool:
+        if not sys.platform.startswith("linux"):
+            return False
+        if cls._libc is None:
+            try:
+                cls._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                cls._libc.inotify_init1
+            except (OSError, AttributeError):
+                cls._libc = False
+        return cls._libc is not False
+
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        if not self.is_available():
+            raise OSError("inotify is not available")
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed", directory)
+
+        self.changes = None
+        self.broken = False
+
+    # Read all pending events without blocking
+    def read_events(self) -> None:
+        while self.fd is not None:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            if len(data) == 0:
+                return
+
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_len = self._event_header.unpack_from(data, offset)
+                offset += self._event_header.size
+                name = os.fsdecode(data[offset: offset + name_len].rstrip(b"\0"))
+                offset += name_len
+
+                if mask & self.IN_Q_OVERFLOW:
+                    # Events were lost
+                    self.changes = None
+                elif mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF | self.IN_IGNORED):
+                    # Watched directory is gone
+                    self.changes = None
+                    self.broken = True
+                elif self.changes is not None and name != "":
+                    self.changes.add(name)
+
+    def pop_changes(self) -> set:
+        self.read_events()
+        changes = self.changes
+        self.changes = set()
+        return changes
+
+    def is_broken(self) -> bool:
+        return self.broken
+
+    def close(self) -> None:
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# Portable backend: compares snapshots of the script files in the directory,
+# made with dirscan.ScriptDir
+class PollingWatcher(DirWatcher):
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.script_dir = dirscan.ScriptDir(directory)
+        self.snapshot = None
+
+    def pop_changes(self) -> set:
+        previous = self.snapshot
+        self.snapshot = {
+            name: (file_stat.st_mtime, file_stat.st_size)
+            for name, file_stat in self.script_dir.scan().items()
+        }
+        if previous is None:
+            return None
+
+        changes = set(previous.keys() ^ self.snapshot.keys())
+        for name, file_stat in self.snapshot.items():
+            prev_stat = previous.get(name)
+            if prev_stat is not None and prev_stat != file_stat:
+                changes.add(name)
+        return changes
+
+
+# Create a directory watcher
+#   backend: one of "auto", "inotify", "polling", "none"
+def create_watcher(directory: str, backend: str = "auto") -> DirWatcher:
+    if backend in ("auto", "inotify") and InotifyWatcher.is_available():
+        try:
+            return InotifyWatcher(directory)
+        except OSError as e:
+            if backend == "inotify":
+                print("nwscript: cannot watch %s with inotify: %s" % (directory, e))
+    if backend in ("auto", "inotify", "polling"):
+        return PollingWatcher(directory)
+    return DirWatcher(directory)
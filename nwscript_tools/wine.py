@@ -0,0 +1,72 @@
+import os
+import subprocess
+
+# Helpers for running NWNScriptCompiler.exe through Wine.
+#
+# When no wineserver is running for the Wine prefix, each compiler process
+# first starts the wineserver and the Wine services, then they all exit a few
+# seconds after the compiler. Keeping a persistent wineserver (wineserver -p)
+# removes this startup cost from every compiler batch.
+#
+# NWNScriptCompiler only takes the scripts to compile on its command line, so
+# compiler processes themselves cannot be kept alive and fed new batches.
+
+WINE_EXECUTABLES = ("wine", "wine64")
+
+
+# Return the index of the wine executable in compiler_cmd, or None if the
+# compiler is not started through Wine
+def find_wine(compiler_cmd: list) -> int:
+    for i, arg in enumerate(compiler_cmd):
+        if os.path.basename(arg) in WINE_EXECUTABLES:
+            return i
+    return None
+
+
+# Build a command running another Wine tool with the same environment as
+# compiler_cmd (for example with an "env WINEPREFIX=..." prefix)
+#   tool: "wineserver", or None to use the wine executable itself
+def get_wine_tool_cmd(compiler_cmd: list, tool: str, args: list) -> list:
+    wine_index = find_wine(compiler_cmd)
+    wine = compiler_cmd[wine_index]
+    if tool is not None:
+        wine = os.path.join(os.path.dirname(wine), tool)
+    return compiler_cmd[:wine_index] + [wine] + args
+
+
+# Start a persistent wineserver for the compiler Wine prefix, and start the
+# Wine services by running a no-op Wine process. Does not wait for them.
+#   keepalive: number of seconds the wineserver stays alive after the last
+#       Wine process exits
+# Returns the started processes
+def start_wineserver(compiler_cmd: list, keepalive: int) -> list:
+    if find_wine(compiler_cmd) is None:
+        return []
+
+    ret = []
+    for cmd in (
+        get_wine_tool_cmd(compiler_cmd, "wineserver", ["-p%d" % keepalive]),
+        get_wine_tool_cmd(compiler_cmd, None, ["cmd", "/c", "exit"]),
+    ):
+        try:
+            ret.append(subprocess.Popen(
+                cmd,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            ))
+        except OSError as e:
+            print("nwscript-smartbuild: could not run %s: %s" % (cmd, e))
+            break
+    return ret
+
+
+# Stop the wineserver of the compiler Wine prefix
+def stop_wineserver(compiler_cmd: list) -> None:
+    if find_wine(compiler_cmd) is None:
+        return
+    subprocess.call(
+        get_wine_tool_cmd(compiler_cmd, "wineserver", ["-k"]),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
@@ -0,0 +1,142 @@
+# Tests for the Sublime Text independent declaration scanner
+#
+# Usage: python -m unittest discover tests
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from nwscript_tools import parser  # noqa: E402
+
+
+def parse_both(data: str, is_nwscript: bool = False) -> (list, bool):
+    result = parser.parse(data, is_nwscript)
+    incremental = parser.IncrementalParser(is_nwscript)
+    assert incremental.parse(data) == result
+    return result
+
+
+def names(decls: list) -> list:
+    return [decl[1] if decl[0] in ("i", "d", "s") else decl[2] for decl in decls]
+
+
+class TestParse(unittest.TestCase):
+    def test_declarations(self):
+        decls, has_main = parse_both(
+            '#include "inc_a"\n'
+            '#define DEF_A 1\n'
+            'const int CONST_A = 2; // Constant A\n'
+            '\n'
+            '// Function A\n'
+            'int FuncA(object oTarget, int nValue=3);\n'
+            '\n'
+            'struct st_a { int a; };\n'
+            'void main() {}\n'
+        )
+        self.assertEqual(decls, [
+            ("i", "inc_a"),
+            ("d", "DEF_A", "1", None),
+            ("c", "int", "CONST_A", "2", "Constant A"),
+            ("f", "int", "FuncA", (("object", "oTarget", None), ("int", "nValue", "3")), "Function A"),
+            ("s", "st_a", None),
+        ])
+        self.assertTrue(has_main)
+
+    def test_block_comment_with_blank_line(self):
+        decls, has_main = parse_both(
+            '/*\n'
+            'old\n'
+            '\n'
+            '#include "old_inc"\n'
+            'void main(){}\n'
+            '*/\n'
+            'int M(int a) { return a; }'
+        )
+        self.assertEqual(decls, [("f", "int", "M", (("int", "a", None),), None)])
+        self.assertFalse(has_main)
+
+    def test_declaration_after_block_comment(self):
+        decls, _ = parse_both(
+            'void FuncA();\n'
+            '/* int Ghost();\n'
+            '\n'
+            'int Ghost2(); */ void FuncB();\n'
+            'void FuncC();\n'
+        )
+        self.assertEqual(names(decls), ["FuncA", "FuncB", "FuncC"])
+
+    def test_unterminated_block_comment(self):
+        decls, has_main = parse_both('void FuncA();\n/*\n\nvoid main() {}\n\nvoid FuncB();\n')
+        self.assertEqual(names(decls), ["FuncA"])
+        self.assertFalse(has_main)
+
+    def test_function_body_with_blank_line(self):
+        decls, _ = parse_both(
+            'int x = 1;\n'
+            'void f()\n'
+            '{\n'
+            '    int a;\n'
+            '\n'
+            '    int y = 2;\n'
+            '    if (a) {\n'
+            '\n'
+            '        int z = 3;\n'
+            '    }\n'
+            '}\n'
+            '\n'
+            'int w = 4;\n',
+            is_nwscript=True
+        )
+        self.assertEqual(names(decls), ["x", "f", "w"])
+
+    def test_main_declaration(self):
+        _, has_main = parse_both('void main();\n// void main() {}\n')
+        self.assertFalse(has_main)
+        _, has_main = parse_both('int StartingConditional()\n{\n\n    return 1;\n}\n')
+        self.assertTrue(has_main)
+
+
+class TestIncrementalParser(unittest.TestCase):
+    def test_state_change(self):
+        incremental = parser.IncrementalParser(False)
+        data = 'void FuncA();\n\nvoid FuncB();\n\nvoid FuncC();\n'
+        self.assertEqual(names(incremental.parse(data)[0]), ["FuncA", "FuncB", "FuncC"])
+
+        # Opening a block comment hides the following blocks
+        data = data.replace("void FuncB", "/* void FuncB")
+        self.assertEqual(names(incremental.parse(data)[0]), ["FuncA"])
+        data = data.replace("void FuncC();", "*/ void FuncC();")
+        self.assertEqual(names(incremental.parse(data)[0]), ["FuncA", "FuncC"])
+
+        # Same for an unclosed function body
+        data = 'void FuncA() {\n\nint FuncB();\n\n}\nvoid FuncC();\n'
+        self.assertEqual(names(incremental.parse(data)[0]), ["FuncA", "FuncC"])
+        data = data.replace("void FuncA() {", "void FuncA();")
+        self.assertEqual(names(incremental.parse(data)[0]), ["FuncA", "FuncB", "FuncC"])
+
+
+class TestNormalizeCode(unittest.TestCase):
+    def test_comments_and_whitespace(self):
+        self.assertEqual(
+            parser.normalize_code('int  f( int a ) // comment\n{\n  /* x */ return a ;\n}\n'),
+            parser.normalize_code('int f(int a) {return a;}'),
+        )
+        self.assertNotEqual(
+            parser.normalize_code('string s = "a  b";'),
+            parser.normalize_code('string s = "a b";'),
+        )
+
+    def test_preprocessor_strings(self):
+        self.assertEqual(
+            parser.normalize_code('#define  MSG   "a  b"  // comment\nvoid f();'),
+            parser.normalize_code('#define MSG "a  b"\nvoid f();'),
+        )
+        self.assertNotEqual(
+            parser.normalize_code('#define MSG "a  b"'),
+            parser.normalize_code('#define MSG "a b"'),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()